@@ -2,640 +2,294 @@ import os
 import re
 import uuid
 import random
-import html
+import json
+import atexit
+import signal
 import time
+import sqlite3
 import threading
-import zipfile
-from io import BytesIO
+import itertools
+import functools
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import closing
+from io import BytesIO, StringIO
 
 from flask import (Flask, render_template, request, jsonify, send_file,
-                   session, send_from_directory)
-from reportlab.lib.pagesizes import A4, LETTER, LEGAL
-from reportlab.lib.units import mm, inch
-from reportlab.lib.colors import HexColor, Color
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas as pdf_canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from PIL import Image
+                   session, send_from_directory, Response, g)
+
+import metrics
+
+from rendering import (GENERATED_DIR, DecodedStream, available_fonts, classify_line, ensure_generated_dir,
+                       generate_pdf, generate_pdf_from_lines, iter_text_lines, line_kind,
+                       parse_generate_request, parse_int, parse_settings, preload_fonts,
+                       resolve_font, result_cache_key, sanitize_text, seeded_inputs)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SESSION_SECRET', 'dev-secret-key-change-in-prod')
 
-FONTS_DIR = os.path.join(os.path.dirname(__file__), 'fonts')
-# Prefer project dir; on read-only FS (e.g. Vercel) use temp dir
-import tempfile
-_default_generated = os.path.join(os.path.dirname(__file__), 'generated')
-_generated_fallback = os.path.join(tempfile.gettempdir(), 'handwriting_generated')
-GENERATED_DIR = _default_generated
-try:
-    os.makedirs(GENERATED_DIR, exist_ok=True)
-except OSError:
-    GENERATED_DIR = _generated_fallback
-    os.makedirs(GENERATED_DIR, exist_ok=True)
-
-AVAILABLE_FONTS = {}
-
-def register_fonts():
-    if not os.path.isdir(FONTS_DIR):
-        os.makedirs(FONTS_DIR, exist_ok=True)
-        return
-    for filename in os.listdir(FONTS_DIR):
-        if filename.endswith('.ttf'):
-            name = os.path.splitext(filename)[0]
-            display_name = name.replace('-Regular', '').replace('QE', '')
-            path = os.path.join(FONTS_DIR, filename)
-            try:
-                pdfmetrics.registerFont(TTFont(display_name, path))
-                AVAILABLE_FONTS[display_name] = path
-            except Exception:
-                pass
-
-register_fonts()
-
-PAGE_SIZES = {
-    'A4': A4,
-    'A3': (297*mm, 420*mm),
-    'A5': (148*mm, 210*mm),
-    'Letter': LETTER,
-    'Legal': LEGAL,
-}
-
-def sanitize_text(text):
-    text = html.escape(text)
-    text = text.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>').replace('&#x27;', "'").replace('&quot;', '"')
-    return text
-
-def classify_line(line):
-    stripped = line.strip()
-    if not stripped:
-        return 'empty', stripped
-    upper = stripped.upper()
-    if any(kw in upper for kw in ['HOME ASSIGNMENT', 'ASSIGNMENT', 'HOMEWORK']):
-        return 'title', stripped
-    if re.match(r'^(NAME|STUDENT NAME)\s*[:.]', stripped, re.IGNORECASE):
-        return 'name', stripped
-    if re.match(r'^(ID|ROLL NO|STUDENT ID|REG)\s*[:.]', stripped, re.IGNORECASE):
-        return 'id', stripped
-    if re.match(r'^(DATE|SUBMITTED ON)\s*[:.]', stripped, re.IGNORECASE):
-        return 'date', stripped
-    if re.match(r'^(SUBJECT|COURSE|CLASS)\s*[:.]', stripped, re.IGNORECASE):
-        return 'subject', stripped
-    if re.match(r'^\d+[\.\)]\s+', stripped):
-        return 'question', stripped
-    if re.match(r'^(Q\d+|Question\s+\d+)', stripped, re.IGNORECASE):
-        return 'question', stripped
-    if re.match(r'^(Ans|Answer|A)\s*[:.\)]\s*', stripped, re.IGNORECASE):
-        return 'answer_label', stripped
-    if stripped.startswith('#'):
-        return 'heading', stripped.lstrip('#').strip()
-    return 'answer', stripped
-
-def draw_page_background(c, width, height, settings):
-    page_style = settings.get('page_style', 'blank')
-    margin_left = settings.get('margin_left', 60)
-
-    if page_style == 'cream':
-        c.setFillColor(HexColor('#FFF8E7'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-    elif page_style == 'aged':
-        c.setFillColor(HexColor('#F5E6C8'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setFillColor(HexColor('#EAD5AA'))
-        for _ in range(25):
-            x = random.uniform(0, width)
-            y = random.uniform(0, height)
-            r = random.uniform(1, 5)
-            c.circle(x, y, r, fill=1, stroke=0)
-    elif page_style == 'recycled':
-        c.setFillColor(HexColor('#DCD6CB'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setStrokeColor(HexColor('#C4BBAF'))
-        for _ in range(100):
-            x = random.uniform(0, width)
-            y = random.uniform(0, height)
-            c.line(x, y, x + random.uniform(1, 3), y + random.uniform(1, 3))
-    elif page_style == 'parchment':
-        c.setFillColor(HexColor('#FCF5E5'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setStrokeColor(HexColor('#F0E4C8'))
-        c.setLineWidth(0.5)
-        for _ in range(30):
-            x = random.uniform(0, width)
-            y = random.uniform(0, height)
-            c.circle(x, y, random.uniform(10, 30), fill=0, stroke=1)
-    elif page_style == 'legal_yellow':
-        c.setFillColor(HexColor('#FFF9C4'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setStrokeColor(HexColor('#E0E0E0'))
-        c.setLineWidth(0.3)
-        line_spacing = settings.get('line_spacing', 28)
-        y = height - 60
-        while y > 40:
-            c.line(margin_left, y, width - 30, y)
-            y -= line_spacing
-        c.setStrokeColor(HexColor('#FF9999'))
-        c.setLineWidth(0.8)
-        c.line(margin_left, height, margin_left, 0)
-    elif page_style == 'notebook':
-        c.setFillColor(HexColor('#FFFFFF'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setStrokeColor(HexColor('#E0E0E0'))
-        c.setLineWidth(0.3)
-        line_spacing = settings.get('line_spacing', 28)
-        y = height - 60
-        while y > 40:
-            c.line(margin_left, y, width - 30, y)
-            y -= line_spacing
-        c.setStrokeColor(HexColor('#FF9999'))
-        c.setLineWidth(0.8)
-        c.line(margin_left, height, margin_left, 0)
-    elif page_style == 'grid':
-        c.setFillColor(HexColor('#FFFFFF'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setStrokeColor(HexColor('#E8E8E8'))
-        c.setLineWidth(0.2)
-        step = 20
-        x = 0
-        while x <= width:
-            c.line(x, 0, x, height)
-            x += step
-        y = 0
-        while y <= height:
-            c.line(0, y, width, y)
-            y += step
-    elif page_style == 'grain':
-        c.setFillColor(HexColor('#FDFBF7'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setFillColor(HexColor('#E8E4DC'))
-        for _ in range(400):
-            x = random.uniform(0, width)
-            y = random.uniform(0, height)
-            r = random.uniform(0.3, 1)
-            c.circle(x, y, r, fill=1, stroke=0)
-    elif page_style == 'fold_crease':
-        c.setFillColor(HexColor('#FFFFFF'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        c.setStrokeColor(HexColor('#E8E8E8'))
-        c.setLineWidth(0.5)
-        crease_y = height * 0.35 + random.uniform(-20, 20)
-        c.line(0, crease_y, width, crease_y + random.uniform(-3, 3))
-    elif page_style == 'corner_shadow':
-        c.setFillColor(HexColor('#FFFFFF'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        for (cx, cy) in [(0, 0), (width, 0), (0, height), (width, height)]:
-            c.setFillColor(HexColor('#F0F0F0'))
-            c.circle(cx, cy, 80, fill=1, stroke=0)
+# Process-pool rendering. RENDER_PROCESSES=0 (the default) renders in the
+# calling thread; a number (or "auto" for one per core) starts that many
+# worker processes, each reading the font index once at startup.
+_render_processes = os.environ.get('RENDER_PROCESSES', '0')
+RENDER_PROCESSES = (os.cpu_count() or 1) if _render_processes == 'auto' else max(0, int(_render_processes))
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', '110'))
+RENDER_MAX_TASKS = max(1, int(os.environ.get('RENDER_MAX_TASKS', '50')))
+
+
+class RenderTimeout(Exception):
+    """A render ran past its per-task time limit."""
+
+
+def _init_render_worker():
+    # Spawned workers import this module fresh; load fonts before the first
+    # task rather than inside it: all of them with FONT_PRELOAD=1, otherwise
+    # the default font most renders use.
+    if os.environ.get('FONT_PRELOAD') == '1':
+        preload_fonts()
     else:
-        c.setFillColor(HexColor('#FFFFFF'))
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-
-def apply_realism(value, variation, enabled):
-    if not enabled:
-        return value
-    return value + random.uniform(-variation, variation)
-
-def generate_pdf(text, settings):
-    page_size_name = settings.get('page_size', 'A4')
-    page_size = PAGE_SIZES.get(page_size_name, A4)
-    width, height = page_size
-
-    font_name = settings.get('font', 'ComicNeue')
-    if font_name not in AVAILABLE_FONTS:
-        font_name = list(AVAILABLE_FONTS.keys())[0] if AVAILABLE_FONTS else 'Helvetica'
-
-    font_size = settings.get('font_size', 18)
-    line_spacing = settings.get('line_spacing', 28)
-    ink_color = settings.get('ink_color', '#0A1F5C')
-    margin_left = settings.get('margin_left', 60)
-    margin_right = max(40, settings.get('margin_right', 40))
-    margin_top = 50
-    margin_bottom = 50
-
-    spacing_variation = settings.get('spacing_variation', True)
-    jitter = settings.get('jitter', True)
-    ink_variation = settings.get('ink_variation', True)
-    word_size_variation = settings.get('word_size_variation', True)
-    baseline_shift = settings.get('baseline_shift', True)
-    jitter_strength = settings.get('jitter_strength', 1.0)
-    ink_flow = settings.get('ink_flow', True)
-    gel_pen = settings.get('gel_pen', False)
-    new_question_on_new_page = settings.get('new_question_on_new_page', False)
-    margin_rule = settings.get('margin_rule', True)
-    double_margin = settings.get('double_margin', False)
-    bold_question = settings.get('bold_question', False)
-    underline_headings = settings.get('underline_headings', False)
-    signature_data = settings.get('signature_base64')
-    page_numbers = settings.get('page_numbers', False)
-    header_text = settings.get('header_text', '')
-    footer_text = settings.get('footer_text', '')
-    watermark_text = settings.get('watermark_text', '')
-
-    filename = f"{uuid.uuid4().hex}.pdf"
-    filepath = os.path.join(GENERATED_DIR, filename)
+        resolve_font({})
 
-    c = pdf_canvas.Canvas(filepath, pagesize=page_size)
-    page_num = 1
-
-    def draw_header_footer(page_num_val, total_pages=None):
-        """Draw header, footer, page numbers, and watermark."""
-        # Header
-        if header_text:
-            c.setFont(font_name, font_size - 2)
-            c.setFillColor(HexColor('#666666'))
-            header_y = height - 25
-            tw = c.stringWidth(header_text, font_name, font_size - 2)
-            c.drawString((width - tw) / 2, header_y, header_text)
-        
-        # Footer
-        footer_y = 20
-        footer_items = []
-        if footer_text:
-            footer_items.append(footer_text)
-        if page_numbers:
-            page_str = f"Page {page_num_val}"
-            if total_pages:
-                page_str += f" of {total_pages}"
-            footer_items.append(page_str)
-        
-        if footer_items:
-            footer_line = " • ".join(footer_items)
-            c.setFont(font_name, font_size - 3)
-            c.setFillColor(HexColor('#666666'))
-            tw = c.stringWidth(footer_line, font_name, font_size - 3)
-            c.drawString((width - tw) / 2, footer_y, footer_line)
-        
-        # Watermark
-        if watermark_text:
-            c.saveState()
-            c.setFont(font_name, font_size + 10)
-            c.setFillColor(HexColor('#E0E0E0'))
-            c.rotate(45)
-            tw = c.stringWidth(watermark_text, font_name, font_size + 10)
-            c.drawString(width / 2 - tw / 2, height / 2, watermark_text)
-            c.restoreState()
-
-    draw_page_background(c, width, height, settings)
-    page_style = settings.get('page_style', 'blank')
-    if margin_rule and page_style not in ('legal_yellow', 'notebook'):
-        c.setStrokeColor(HexColor('#FF9999'))
-        c.setLineWidth(0.8)
-        c.line(margin_left, height, margin_left, 0)
-        if double_margin:
-            c.line(margin_left + 12, height, margin_left + 12, 0)
-    
-    # Draw header/footer/watermark on first page
-    # We'll need to count pages first, so we'll do this after content generation
-    # For now, draw on first page
-    draw_header_footer(page_num)
-
-    lines = text.split('\n')
-    y = height - margin_top
-    x_base = margin_left + 10
-    if margin_rule:
-        x_base = margin_left + 16 if double_margin else margin_left + 10
-
-    usable_width = width - margin_left - margin_right - 20
-    if margin_rule:
-        usable_width -= 4
-    if double_margin:
-        usable_width -= 4
-
-    for line in lines:
-        line_type, content = classify_line(line)
-
-        if line_type == 'empty':
-            y -= line_spacing * 0.6
-            if y < margin_bottom:
-                c.showPage()
-                page_num += 1
-                draw_page_background(c, width, height, settings)
-                if margin_rule:
-                    c.setStrokeColor(HexColor('#FF9999'))
-                    c.setLineWidth(0.8)
-                    c.line(margin_left, height, margin_left, 0)
-                    if double_margin:
-                        c.line(margin_left + 12, height, margin_left + 12, 0)
-                draw_header_footer(page_num)
-                y = height - margin_top
-            continue
 
-        if line_type == 'question' and new_question_on_new_page and y < height - margin_top - 50:
-            c.showPage()
-            page_num += 1
-            draw_page_background(c, width, height, settings)
-            if margin_rule:
-                c.setStrokeColor(HexColor('#FF9999'))
-                c.setLineWidth(0.8)
-                c.line(margin_left, height, margin_left, 0)
-                if double_margin:
-                    c.line(margin_left + 12, height, margin_left + 12, 0)
-            draw_header_footer(page_num)
-            y = height - margin_top
-
-        if line_type == 'title':
-            c.setFont(font_name, font_size + 6)
-            c.setFillColor(HexColor('#000000'))
-            tw = c.stringWidth(content, font_name, font_size + 6)
-            x = (width - tw) / 2
-            jitter_y = apply_realism(0, 1.5, jitter)
-            c.drawString(x, y + jitter_y, content)
-            if underline_headings:
-                c.setStrokeColor(HexColor('#000000'))
-                c.setLineWidth(0.5)
-                c.line(x, y - 2, x + tw, y - 2)
-            y -= line_spacing * 1.8
-        elif line_type in ('name', 'id', 'subject'):
-            c.setFont(font_name, font_size + 1)
-            c.setFillColor(HexColor('#000000'))
-            jitter_x = apply_realism(0, 1, jitter)
-            jitter_y = apply_realism(0, 1, jitter)
-            c.drawString(x_base + jitter_x, y + jitter_y, content)
-            y -= line_spacing * 1.3
-        elif line_type == 'date':
-            c.setFont(font_name, font_size + 1)
-            c.setFillColor(HexColor('#000000'))
-            tw = c.stringWidth(content, font_name, font_size + 1)
-            x = width - margin_right - tw - 10
-            jitter_y = apply_realism(0, 1, jitter)
-            c.drawString(x, y + jitter_y, content)
-            y -= line_spacing * 1.3
-        elif line_type == 'question':
-            qfs = font_size + 1
-            c.setFont(font_name, qfs)
-            c.setFillColor(HexColor('#000000'))
-            wrapped = wrap_text(content, font_name, qfs, usable_width, c)
-            for wl in wrapped:
-                if y < margin_bottom:
-                    c.showPage()
-                    page_num += 1
-                    draw_page_background(c, width, height, settings)
-                    if margin_rule:
-                        c.setStrokeColor(HexColor('#FF9999'))
-                        c.setLineWidth(0.8)
-                        c.line(margin_left, height, margin_left, 0)
-                        if double_margin:
-                            c.line(margin_left + 12, height, margin_left + 12, 0)
-                    draw_header_footer(page_num)
-                    y = height - margin_top
-                jitter_x = apply_realism(0, 1.2, jitter)
-                jitter_y = apply_realism(0, 1, jitter)
-                if bold_question:
-                    c.drawString(x_base + jitter_x + 0.4, y + jitter_y, wl)
-                c.drawString(x_base + jitter_x, y + jitter_y, wl)
-                y -= apply_realism(line_spacing, 2, spacing_variation)
-            y -= line_spacing * 0.3
-        elif line_type == 'heading':
-            hfs = font_size + 3
-            c.setFont(font_name, hfs)
-            c.setFillColor(HexColor('#000000'))
-            wrapped_heading = wrap_text(content, font_name, hfs, usable_width, c)
-            for wh in wrapped_heading:
-                jitter_y = apply_realism(0, 1, jitter)
-                c.drawString(x_base, y + jitter_y, wh)
-                if underline_headings:
-                    tw = c.stringWidth(wh, font_name, hfs)
-                    c.setStrokeColor(HexColor('#000000'))
-                    c.setLineWidth(0.5)
-                    c.line(x_base, y - 2, x_base + tw, y - 2)
-                y -= line_spacing * 1.2
-            y -= line_spacing * 0.3
-        elif line_type == 'answer_label':
-            actual_color = ink_color
-            if ink_variation:
-                base = HexColor(ink_color)
-                r_var = min(1, max(0, base.red + random.uniform(-0.03, 0.03)))
-                g_var = min(1, max(0, base.green + random.uniform(-0.03, 0.03)))
-                b_var = min(1, max(0, base.blue + random.uniform(-0.03, 0.03)))
-                c.setFillColor(Color(r_var, g_var, b_var))
-            else:
-                c.setFillColor(HexColor(actual_color))
-            c.setFont(font_name, font_size)
-            jitter_x = apply_realism(0, 1, jitter)
-            jitter_y = apply_realism(0, 1, jitter)
-            c.drawString(x_base + jitter_x, y + jitter_y, content)
-            y -= apply_realism(line_spacing, 2, spacing_variation)
-        else:
-            realistic_settings = {
-                'word_size_variation': word_size_variation,
-                'baseline_shift': baseline_shift,
-                'jitter_strength': jitter_strength,
-                'ink_flow': ink_flow,
-                'gel_pen': gel_pen,
-            }
-            wrapped = wrap_text(content, font_name, font_size, usable_width, c)
-            for wl in wrapped:
-                if y < margin_bottom:
-                    c.showPage()
-                    page_num += 1
-                    draw_page_background(c, width, height, settings)
-                    if margin_rule:
-                        c.setStrokeColor(HexColor('#FF9999'))
-                        c.setLineWidth(0.8)
-                        c.line(margin_left, height, margin_left, 0)
-                        if double_margin:
-                            c.line(margin_left + 12, height, margin_left + 12, 0)
-                    draw_header_footer(page_num)
-                    y = height - margin_top
-                jitter_x = apply_realism(0, 1.5, jitter)
-                jitter_y = apply_realism(0, 1, jitter)
-                start_y = y
-                if (spacing_variation or jitter) and (word_size_variation or baseline_shift or ink_flow):
-                    end_y = draw_realistic_text(c, wl, x_base + jitter_x, y + jitter_y, font_name, font_size, ink_color, realistic_settings, usable_width)
-                    y = end_y - apply_realism(line_spacing, 1.5, spacing_variation)
-                elif spacing_variation and jitter:
-                    end_y = draw_jittered_text(c, wl, x_base + jitter_x, y + jitter_y, font_name, font_size, usable_width)
-                    y = end_y - apply_realism(line_spacing, 1.5, spacing_variation)
-                else:
-                    if ink_variation or ink_flow:
-                        base = HexColor(ink_color)
-                        r = min(1, max(0, base.red + random.uniform(-0.03, 0.03)))
-                        g = min(1, max(0, base.green + random.uniform(-0.03, 0.03)))
-                        b = min(1, max(0, base.blue + random.uniform(-0.03, 0.03)))
-                        c.setFillColor(Color(r, g, b))
-                    else:
-                        c.setFillColor(HexColor(ink_color))
-                    c.setFont(font_name, font_size)
-                    c.drawString(x_base + jitter_x, y + jitter_y, wl)
-                    y -= apply_realism(line_spacing, 2, spacing_variation)
-
-        if y < margin_bottom:
-            c.showPage()
-            page_num += 1
-            draw_page_background(c, width, height, settings)
-            if margin_rule:
-                c.setStrokeColor(HexColor('#FF9999'))
-                c.setLineWidth(0.8)
-                c.line(margin_left, height, margin_left, 0)
-                if double_margin:
-                    c.line(margin_left + 12, height, margin_left + 12, 0)
-            draw_header_footer(page_num)
-            y = height - margin_top
-
-    # Update footer with total page count on all pages
-    total_pages = page_num
-    # Note: ReportLab doesn't easily allow updating pages after creation
-    # So we'll draw page numbers as we go, but total count will be approximate
-    # For exact count, we'd need a two-pass approach
-    
-    if signature_data:
+def _on_render_alarm(signum, frame):
+    raise RenderTimeout('Rendering took too long')
+
+
+def _render_task(text, settings, timeout, in_memory=False):
+    """generate_pdf inside a pool worker, interrupted by SIGALRM after timeout seconds."""
+    use_alarm = bool(timeout) and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_render_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if in_memory:
+            return generate_pdf(text, settings, BytesIO()).getvalue()
+        return generate_pdf(text, settings)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class RenderEngine:
+    """Runs generate_pdf in a pool of worker processes so renders use every core.
+
+    Workers preload fonts at startup, are recycled after max_tasks_per_child
+    renders to keep memory in check, and each task is cut off after timeout
+    seconds. A pool broken by a crashed worker is replaced on the next call.
+    """
+
+    def __init__(self, workers, timeout=RENDER_TIMEOUT, max_tasks_per_child=RENDER_MAX_TASKS):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_render_worker,
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, text, settings, in_memory=False):
+        """Render and wait for the result; raises RenderTimeout past the time limit."""
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self._pool()
+        future = executor.submit(_render_task, text, settings, self.timeout, in_memory)
         try:
-            import base64
-            raw = signature_data
-            if ',' in raw:
-                raw = raw.split(',', 1)[1]
-            img_data = base64.b64decode(raw)
-            img = Image.open(BytesIO(img_data)).convert('RGBA')
-            img.thumbnail((120, 50), Image.Resampling.LANCZOS)
-            buf = BytesIO()
-            img.save(buf, 'PNG')
-            buf.seek(0)
-            ir = ImageReader(buf)
-            c.drawImage(ir, margin_left, margin_bottom, width=img.width, height=img.height)
-        except Exception:
+            # The worker enforces the limit itself; the extra wait covers queueing
+            # behind other renders and platforms without SIGALRM.
+            return future.result(timeout=self.timeout * 2 if self.timeout else None)
+        except FutureTimeout:
+            future.cancel()
+            raise RenderTimeout('Rendering took too long')
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_render_engine = RenderEngine(RENDER_PROCESSES) if RENDER_PROCESSES else None
+if _render_engine is not None:
+    atexit.register(_render_engine.shutdown)
+
+
+def render_pdf(text, settings, in_memory=False, in_process=False):
+    """Render a PDF through the process pool when one is configured, else in this thread.
+
+    Returns the generated filename, or the PDF bytes when in_memory is set.
+    in_process skips the pool (for profiling).
+    """
+    with metrics.timer('render_seconds', page_style=settings.get('page_style', 'blank')):
+        if in_process or _render_engine is None:
+            if in_memory:
+                return generate_pdf(text, settings, BytesIO()).getvalue()
+            return generate_pdf(text, settings)
+        return _render_engine.render(text, settings, in_memory)
+
+def iter_in_order(submit, items, window):
+    """Yield submit(item).result() for each item, in order, with at most window futures in flight."""
+    items = iter(items)
+    pending = deque(submit(item) for item in itertools.islice(items, window))
+    while pending:
+        future = pending.popleft()
+        for item in itertools.islice(items, 1):
+            pending.append(submit(item))
+        yield future.result()
+
+# Generated PDFs double as the result cache: deterministic renders are stored
+# as <content hash>.pdf. Files are evicted least-recently-used first once they
+# are older than CACHE_MAX_AGE or the directory exceeds CACHE_MAX_BYTES.
+CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', '3600'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_MB', '512')) * 1024 * 1024
+CACHE_SWEEP_INTERVAL = 300
+# Function platforms freeze the process between invocations, so no sweeper there
+SERVERLESS = bool(os.environ.get('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+
+
+def _cache_lookup(text, settings):
+    """Cache filename for a deterministic request, and whether it is already on disk."""
+    filename = f'{result_cache_key(text, settings)}.pdf'
+    try:
+        os.utime(os.path.join(GENERATED_DIR, filename))  # refresh its LRU position
+        metrics.count('cache_hits')
+        return filename, True
+    except FileNotFoundError:
+        metrics.count('cache_misses')
+        return filename, False
+
+
+def render_cached(text, settings, in_process=False):
+    """Render, or reuse an earlier identical render when settings['deterministic'] is set.
+
+    Deterministic renders seed every random choice from the content hash, so a
+    repeat request maps to the same cached file. Returns (filename, cache_hit).
+    """
+    if not settings.get('deterministic'):
+        return render_pdf(text, settings, in_process=in_process), False
+    filename, hit = _cache_lookup(text, settings)
+    if hit:
+        return filename, True
+    rendered = render_pdf(*seeded_inputs(text, settings), in_process=in_process)
+    os.replace(os.path.join(GENERATED_DIR, rendered), os.path.join(GENERATED_DIR, filename))
+    return filename, False
+
+
+def render_stream(text, settings, in_process=False):
+    """PDF for a streamed response: the cached file's path on a deterministic hit, else rendered bytes.
+
+    Nothing is written to GENERATED_DIR.
+    """
+    if settings.get('deterministic'):
+        filename, hit = _cache_lookup(text, settings)
+        if hit:
+            return os.path.join(GENERATED_DIR, filename)
+        text, settings = seeded_inputs(text, settings)
+    return render_pdf(text, settings, in_memory=True, in_process=in_process)
+
+
+def evict_generated_files(max_age=CACHE_MAX_AGE, max_bytes=CACHE_MAX_BYTES):
+    """Delete generated PDFs (and profiles) past max_age, then least recently used ones until under max_bytes."""
+    now = time.time()
+    entries = []
+    with os.scandir(GENERATED_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(('.pdf', '.prof')) or not entry.is_file():
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
             pass
 
-    c.save()
-    return filename
-
-def draw_jittered_text(c, text, x, y, font_name, font_size, max_width=None):
-    """Draw text with per-character jitter; wrap to next line if max_width exceeded."""
-    start_x = x
-    current_y = y
-    line_height = font_size * 1.35
-    effective_max = (max_width - 4) if max_width else None
-    for char in text:
-        cw = c.stringWidth(char, font_name, font_size)
-        extra = random.uniform(-0.2, 0.25)
-        if effective_max and (x - start_x) + cw + max(0, extra) > effective_max and (x > start_x):
-            x = start_x
-            current_y -= line_height
-            extra = 0
-        jx = random.uniform(-0.4, 0.4)
-        jy = random.uniform(-0.5, 0.5)
-        c.drawString(x + jx, current_y + jy, char)
-        x += cw + extra
-    return current_y
-
-
-def get_ink_color_with_flow(base_hex, position_ratio, ink_flow, gel_pen):
-    """Ink flow: darker at start, slight fade at end. Gel pen: slightly richer/darker."""
-    base = HexColor(base_hex)
-    r, g, b = base.red, base.green, base.blue
-    if ink_flow:
-        # Slight darker at start (0), slight fade at end (1)
-        fade = 1.0 - (position_ratio * 0.12)
-        r, g, b = r * fade, g * fade, b * fade
-    if gel_pen:
-        r = min(1, r * 1.08)
-        g = min(1, g * 1.02)
-        b = min(1, b * 0.95)
-    r = min(1, max(0, r + random.uniform(-0.02, 0.02)))
-    g = min(1, max(0, g + random.uniform(-0.02, 0.02)))
-    b = min(1, max(0, b + random.uniform(-0.02, 0.02)))
-    return Color(r, g, b)
-
-
-def draw_realistic_text(c, text, x, y, font_name, font_size, ink_color, settings, max_width=None):
-    """Per-letter variation: word size variation, baseline shift, horizontal jitter. Respects max_width for wrapping."""
-    word_size_var = settings.get('word_size_variation', True)
-    baseline_shift = settings.get('baseline_shift', True)
-    jitter_strength = settings.get('jitter_strength', 1.0)
-    ink_flow = settings.get('ink_flow', True)
-    gel_pen = settings.get('gel_pen', False)
-    words = text.split()
-    if not words:
-        return y
-    current_x = x
-    current_y = y
-    line_height = font_size * 1.4
-    # Leave room for horizontal jitter so we never draw past margin
-    effective_max = (max_width - 5) if max_width else None
-    for i, word in enumerate(words):
-        pos_ratio = i / max(1, len(words))
-        color = get_ink_color_with_flow(ink_color, pos_ratio, ink_flow, gel_pen)
-        c.setFillColor(color)
-        size = font_size
-        if word_size_var:
-            size = font_size + random.uniform(-1.2, 1.5)
-            size = max(font_size - 1, min(font_size + 2, size))
-        c.setFont(font_name, size)
-        word_width = c.stringWidth(word, font_name, size)
-        space_width = c.stringWidth(' ', font_name, size) if current_x > x else 0
-        random_spacing = random.uniform(-0.1, 0.2)
-        current_line_width = current_x - x
-        total_width_needed = current_line_width + space_width + word_width + max(0, random_spacing)
-        if effective_max and total_width_needed > effective_max:
-            if current_x > x:
-                current_x = x
-                current_y -= line_height
-                space_width = 0
-                random_spacing = 0
-            else:
-                # Word itself is too wide, truncate to fit
-                if word_width > effective_max:
-                    ratio = (effective_max - 2) / word_width
-                    word = word[:max(1, int(len(word) * ratio))]
-                    word_width = c.stringWidth(word, font_name, size)
-        by = current_y
-        if baseline_shift:
-            by = current_y + random.uniform(-1.2, 1.2) * jitter_strength
-        jx = random.uniform(-0.5, 0.5) * jitter_strength if jitter_strength else 0
-        jy = random.uniform(-0.5, 0.5) * jitter_strength if jitter_strength else 0
-        if current_x > x and space_width > 0:
-            c.drawString(current_x + jx, by + jy, ' ')
-            current_x += space_width
-        c.drawString(current_x + jx, by + jy, word)
-        current_x += word_width + random_spacing
-        if effective_max and (current_x - x) > effective_max:
-            current_x = x + effective_max
-    return current_y
-
-def wrap_text(text, font_name, font_size, max_width, c):
-    """Wrap text to fit within max_width, with safety margin for variable font sizes and jitter."""
-    words = text.split()
-    lines = []
-    current_line = ''
-    # Use 85% so variable font size (+2pt) and per-char/word jitter don't overflow
-    safe_width = max_width * 0.85
-    for word in words:
-        test_line = f"{current_line} {word}".strip() if current_line else word
-        tw = c.stringWidth(test_line, font_name, font_size)
-        if tw <= safe_width:
-            current_line = test_line
-        else:
-            if current_line:
-                lines.append(current_line)
-            current_line = word
-    if current_line:
-        lines.append(current_line)
-    return lines if lines else ['']
 
 def cleanup_old_files():
     while True:
-        time.sleep(3600)
-        now = time.time()
-        for f in os.listdir(GENERATED_DIR):
-            fp = os.path.join(GENERATED_DIR, f)
-            if os.path.isfile(fp) and now - os.path.getmtime(fp) > 3600:
-                try:
-                    os.remove(fp)
-                except Exception:
-                    pass
+        time.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            evict_generated_files()
+        except OSError:
+            pass
+        try:
+            expire_jobs(CACHE_MAX_AGE)
+        except sqlite3.Error:
+            pass
 
-cleanup_thread = threading.Thread(target=cleanup_old_files, daemon=True)
-cleanup_thread.start()
+_cleanup_thread = None
+_cleanup_lock = threading.Lock()
+
+def start_background_tasks():
+    """Start the cache sweeper thread (long-running servers only, see create_app and _start_sweeper)."""
+    global _cleanup_thread
+    if _cleanup_thread is not None:
+        return
+    with _cleanup_lock:
+        if _cleanup_thread is None:
+            _cleanup_thread = threading.Thread(target=cleanup_old_files, daemon=True)
+            _cleanup_thread.start()
+
+
+# ?profile=1 on /api/generate and /api/export runs the request under cProfile
+# and stores the stats as GENERATED_DIR/<id>.prof, downloadable from
+# /api/profile/<id>. Only honored with PROFILE_REQUESTS=1 or in debug mode.
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') == '1'
+
+
+def profile_requested():
+    """True for ?profile=1; raises PermissionError when profiling is not enabled on this server."""
+    if request.args.get('profile') != '1':
+        return False
+    if not (PROFILE_REQUESTS or app.debug):
+        raise PermissionError('Profiling is disabled; set PROFILE_REQUESTS=1')
+    return True
+
+
+def run_profiled(fn, *args, **kwargs):
+    """Call fn under cProfile and save the stats. Returns (profile id, fn's result)."""
+    import cProfile
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args, **kwargs)
+    profile_id = uuid.uuid4().hex
+    ensure_generated_dir()
+    profiler.dump_stats(os.path.join(GENERATED_DIR, f'{profile_id}.prof'))
+    return profile_id, result
 
 
 @app.route('/')
 def index():
-    fonts = list(AVAILABLE_FONTS.keys())
+    fonts = list(available_fonts().keys())
     return render_template('index.html', fonts=fonts)
 
 
 @app.route('/api/fonts')
 def get_fonts():
-    return jsonify(list(AVAILABLE_FONTS.keys()))
+    return jsonify(list(available_fonts().keys()))
 
 
 @app.route('/api')
@@ -655,6 +309,7 @@ def api_info():
                     'margin_left': 'int (optional)',
                     'page_style': 'blank|cream|aged|notebook|grid|grain|fold_crease|corner_shadow|... (optional)',
                     'page_size': 'A4|A3|A5|Letter|Legal (optional)',
+                    'background_seed': 'int (optional) - reproducible page texture',
                     'spacing_variation': 'bool (optional)',
                     'jitter': 'bool (optional)',
                     'ink_flow': 'bool (optional)',
@@ -662,11 +317,28 @@ def api_info():
                     'margin_rule': 'bool (optional)',
                     'new_question_on_new_page': 'bool (optional)',
                     'signature_base64': 'data URL or base64 image (optional)',
+                    'deterministic': 'bool (optional) - same text + settings give the same PDF, served from cache on repeats',
                 },
-                'response': '{ "filename": "abc123.pdf" } or { "error": "..." }',
+                'response': '{ "filename": "abc123.pdf" } or { "error": "..." }. With ?stream=1 the PDF itself is returned and nothing is stored.',
             },
+            'POST /api/generate/text': 'For long documents: the raw UTF-8 text as the request body, /api/generate settings as query '
+                                       'parameters (?font=ComicNeue&page_numbers=true). Rendered page by page with flat memory; '
+                                       'returns { "filename": "..." }. Page numbers read "Page X" without the total; lines over 65536 '
+                                       'characters are broken at a space; not cached.',
+            'POST /api/generate/batch': 'Body: { "items": [{ "text": "...", "settings": {...} }] } and/or { "settings": {...}, "texts": ["...", ...] }. '
+                                        'Returns { "items": [{ "index": 0, "filename": "..." } | { "index": 1, "error": "..." }] }; '
+                                        'with ?format=zip, a streamed ZIP of PDFs plus manifest.json.',
+            'POST /api/jobs': 'Same body as /api/generate. Queues the render and returns { "id": "...", "status": "queued" } (429 when the queue is full).',
+            'GET /api/jobs/<id>': 'Job status: { "status": "queued|running|done|error", "filename": "..." } once done.',
+            'POST /api/generate/images/jpg|png': 'Same body as /api/generate, rendered straight to page images without a PDF '
+                                                 '(faster). Takes the /api/export query options; returns a ZIP, or one image with ?single=1.',
             'GET /api/download/<filename>': 'Download generated PDF (filename from generate response)',
-            'GET /api/export/<filename>/jpg|png': 'Export first page as image. Add ?scan=1 for scan effect.',
+            'GET /api/profile/<id>': 'cProfile stats saved by ?profile=1 on /api/generate or /api/export (PROFILE_REQUESTS=1 or debug only): '
+                                     'a pstats file, or ?format=txt for the top functions. The id is in the "profile" field or X-Profile-Id header.',
+            'GET /api/export/<filename>/jpg|png': 'Export pages as a ZIP of images. Options: ?scan=1 for scan effect, '
+                                                  '?scan_seed=N for reproducible noise, ?scan_fast=1 for a single-pass tilt+blur, '
+                                                  '?dpi=36-300 (default 200), ?pages=1-3,7, ?single=1 for just the first selected page as one image.',
+            'GET /metrics': 'Prometheus metrics: stage timings, render counters, latency histograms per route and page_style (only with METRICS=1).',
             'POST /api/auto-structure': 'Body: { "text": "..." }. Returns { "structured": "..." } with formatted headings/questions.',
         },
     })
@@ -678,69 +350,94 @@ def generate():
     if not data or 'text' not in data:
         return jsonify({'error': 'No text provided'}), 400
 
-    text = sanitize_text(data['text'][:50000])
+    text, settings = parse_generate_request(data)
+    try:
+        profile = profile_requested()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    profile_id = None
 
-    def _int(val, default, lo, hi):
+    if request.args.get('stream') == '1':
         try:
-            return max(lo, min(hi, int(val)))
-        except (TypeError, ValueError):
-            return default
+            if profile:
+                profile_id, pdf = run_profiled(render_stream, text, settings, in_process=True)
+            else:
+                pdf = render_stream(text, settings)
+        except RenderTimeout as e:
+            return jsonify({'error': str(e)}), 504
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if isinstance(pdf, bytes):
+            pdf = BytesIO(pdf)
+        response = send_file(pdf, mimetype='application/pdf', as_attachment=True,
+                             download_name='handwritten_assignment.pdf')
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
 
-    def _float(val, default, lo, hi):
-        try:
-            return max(lo, min(hi, float(val)))
-        except (TypeError, ValueError):
-            return default
-
-    def _bool(val, default=True):
-        if val is None:
-            return default
-        if isinstance(val, bool):
-            return val
-        return default
-
-    settings = {
-        'font': data.get('font') or 'ComicNeue',
-        'font_size': _int(data.get('font_size'), 18, 10, 36),
-        'line_spacing': _int(data.get('line_spacing'), 28, 16, 50),
-        'ink_color': data.get('ink_color') or '#0A1F5C',
-        'margin_left': _int(data.get('margin_left'), 60, 20, 120),
-        'page_style': data.get('page_style') or 'blank',
-        'page_size': data.get('page_size') or 'A4',
-        'spacing_variation': _bool(data.get('spacing_variation'), True),
-        'jitter': _bool(data.get('jitter'), True),
-        'ink_variation': _bool(data.get('ink_variation'), True),
-        'word_size_variation': _bool(data.get('word_size_variation'), True),
-        'baseline_shift': _bool(data.get('baseline_shift'), True),
-        'jitter_strength': _float(data.get('jitter_strength'), 1.0, 0.2, 2.0),
-        'ink_flow': _bool(data.get('ink_flow'), True),
-        'gel_pen': _bool(data.get('gel_pen'), False),
-        'new_question_on_new_page': _bool(data.get('new_question_on_new_page'), False),
-        'margin_rule': _bool(data.get('margin_rule'), True),
-        'double_margin': _bool(data.get('double_margin'), False),
-        'bold_question': _bool(data.get('bold_question'), False),
-        'underline_headings': _bool(data.get('underline_headings'), False),
-        'signature_base64': data.get('signature_base64'),
-        'page_numbers': _bool(data.get('page_numbers'), False),
-        'header_text': (data.get('header_text') or '').strip()[:200],
-        'footer_text': (data.get('footer_text') or '').strip()[:200],
-        'watermark_text': (data.get('watermark_text') or '').strip()[:100],
-    }
-
-    ink = settings['ink_color']
-    if not re.match(r'^#[0-9a-fA-F]{6}$', ink):
-        settings['ink_color'] = '#0A1F5C'
-
-    if settings['font'] not in AVAILABLE_FONTS:
-        settings['font'] = list(AVAILABLE_FONTS.keys())[0] if AVAILABLE_FONTS else 'Helvetica'
+    try:
+        if profile:
+            profile_id, (filename, cached) = run_profiled(render_cached, text, settings, in_process=True)
+        else:
+            filename, cached = render_cached(text, settings)
+        result = {'filename': filename}
+        if settings['deterministic']:
+            result['cached'] = cached
+        if profile_id:
+            result['profile'] = profile_id
+        return jsonify(result)
+    except RenderTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Longest text POST /api/generate/text reads from its body. That endpoint
+# renders page by page, so this bounds render time rather than memory.
+MAX_STREAM_CHARS = max(1, int(os.environ.get('MAX_STREAM_CHARS', '5000000')))
+
+
+def parse_query_settings(args):
+    """A /api/generate-style body from query parameters; 'true'/'false' become booleans."""
+    return {k: {'true': True, 'false': False}.get(v.lower(), v) for k, v in args.items()}
 
+
+@app.route('/api/generate/text', methods=['POST'])
+def generate_from_text():
+    """Render a long document sent as the raw (UTF-8) request body, settings in the query string.
+
+    The body is read, laid out and drawn a chunk at a time instead of being
+    parsed into one string, so memory does not grow with the document.
+    """
+    stream = DecodedStream(request.stream)
+    if not stream.peek():
+        return jsonify({'error': 'No text provided'}), 400
+    settings = parse_settings(parse_query_settings(request.args))
     try:
-        filename = generate_pdf(text, settings)
+        with metrics.timer('render_seconds', page_style=settings['page_style']):
+            filename = generate_pdf_from_lines(iter_text_lines(stream, MAX_STREAM_CHARS), settings)
         return jsonify({'filename': filename})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/profile/<profile_id>')
+def download_profile(profile_id):
+    """A profile saved by ?profile=1: pstats file, or ?format=txt for the top functions by cumulative time."""
+    if not re.match(r'^[a-f0-9]{32}$', profile_id):
+        return jsonify({'error': 'Invalid profile id'}), 400
+    filepath = os.path.join(GENERATED_DIR, f'{profile_id}.prof')
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'txt':
+        import pstats
+        out = StringIO()
+        pstats.Stats(filepath, stream=out).sort_stats('cumulative').print_stats(60)
+        return Response(out.getvalue(), mimetype='text/plain')
+    return send_file(filepath, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'profile_{profile_id}.prof')
+
+
 @app.route('/api/download/<filename>')
 def download_pdf(filename):
     if not re.match(r'^[a-f0-9]+\.pdf$', filename):
@@ -751,50 +448,357 @@ def download_pdf(filename):
     return send_file(filepath, as_attachment=True, download_name='handwritten_assignment.pdf')
 
 
-def apply_scan_effect(img):
-    """Apply scan effect: slight tilt, minor blur, subtle noise, light border shadow."""
-    from PIL import ImageFilter, ImageOps
+JOBS_DB = os.path.join(GENERATED_DIR, 'jobs.sqlite3')
+JOB_WORKERS = max(1, int(os.environ.get('JOB_WORKERS', '2')))
+JOB_QUEUE_LIMIT = max(1, int(os.environ.get('JOB_QUEUE_LIMIT', '20')))
+# A job still 'running' after this long belongs to a worker process that died
+JOB_STALE_AFTER = 600
+
+_job_wakeup = threading.Condition()
+_job_threads = []
+_job_threads_lock = threading.Lock()
+
+
+def _jobs_db():
+    ensure_generated_dir()
+    conn = sqlite3.connect(JOBS_DB, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _start_job_workers():
+    """Create the jobs table and start this process's worker threads on first use."""
+    with _job_threads_lock:
+        if _job_threads:
+            return
+        with closing(_jobs_db()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT, '
+                         'filename TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+        for _ in range(JOB_WORKERS):
+            t = threading.Thread(target=_job_worker, daemon=True)
+            t.start()
+            _job_threads.append(t)
+
+
+def submit_job(text, settings):
+    """Queue a generate_pdf call. Returns the job id, or None when the queue is full."""
+    _start_job_workers()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with closing(_jobs_db()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("UPDATE jobs SET status = 'error', error = 'Worker exited', payload = NULL "
+                     "WHERE status = 'running' AND updated < ?", (now - JOB_STALE_AFTER,))
+        (pending,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()
+        if pending >= JOB_QUEUE_LIMIT:
+            conn.execute('ROLLBACK')
+            return None
+        conn.execute('INSERT INTO jobs (id, status, payload, created, updated) VALUES (?, ?, ?, ?, ?)',
+                     (job_id, 'queued', json.dumps({'text': text, 'settings': settings}), now, now))
+        conn.execute('COMMIT')
+    with _job_wakeup:
+        _job_wakeup.notify()
+    return job_id
+
+
+def get_job(job_id):
+    """Return the job row as a dict, or None if there is no such job."""
+    _start_job_workers()
+    with closing(_jobs_db()) as conn:
+        row = conn.execute('SELECT id, status, filename, error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def expire_jobs(max_age):
+    """Drop finished job records older than max_age seconds."""
+    if not os.path.exists(JOBS_DB):
+        return
+    with closing(_jobs_db()) as conn:
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND updated < ?",
+                     (time.time() - max_age,))
+
+
+def _rollback(conn):
+    """Drop a transaction a failed statement left open, so the connection stays usable."""
+    if conn.in_transaction:
+        try:
+            conn.execute('ROLLBACK')
+        except sqlite3.Error:
+            pass
+
+
+def _claim_job(conn):
     try:
-        import numpy as np
-        has_numpy = True
-    except ImportError:
-        has_numpy = False
-    
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET status = 'running', updated = ? WHERE id = ?", (time.time(), row['id']))
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        _rollback(conn)
+        raise
+    return row
+
+
+def _finish_job(conn, job_id, status, filename, error, attempts=3):
+    """Record a job's result, retrying while the database is busy.
+
+    If every attempt fails the job stays 'running' until submit_job marks it
+    stale after JOB_STALE_AFTER; the worker thread carries on either way.
+    """
+    for attempt in range(attempts):
+        try:
+            conn.execute('UPDATE jobs SET status = ?, filename = ?, error = ?, payload = NULL, updated = ? WHERE id = ?',
+                         (status, filename, error, time.time(), job_id))
+            return
+        except sqlite3.Error as e:
+            _rollback(conn)
+            app.logger.warning(f'Could not record job {job_id} (attempt {attempt + 1} of {attempts}): {e}')
+            if attempt + 1 < attempts:
+                time.sleep(0.5 * (attempt + 1))
+
+
+def _job_worker():
+    """Take queued jobs from the shared table (any gunicorn worker may have queued them) and render them."""
+    conn = _jobs_db()
+    while True:
+        try:
+            row = _claim_job(conn)
+        except sqlite3.Error as e:
+            app.logger.warning(f'Job queue error: {e}')
+            row = None
+        if row is None:
+            with _job_wakeup:
+                _job_wakeup.wait(timeout=1.0)
+            continue
+        payload = json.loads(row['payload'])
+        try:
+            filename, _ = render_cached(payload['text'], payload['settings'])
+            status, error = 'done', None
+        except Exception as e:
+            filename, status, error = None, 'error', str(e)
+        _finish_job(conn, row['id'], status, filename, error)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    data = request.get_json()
+    if not data or 'text' not in data:
+        return jsonify({'error': 'No text provided'}), 400
+
+    text, settings = parse_generate_request(data)
+    job_id = submit_job(text, settings)
+    if job_id is None:
+        resp = jsonify({'error': 'Too many queued jobs, try again shortly'})
+        resp.headers['Retry-After'] = '5'
+        return resp, 429
+    return jsonify({'id': job_id, 'status': 'queued'}), 202
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    if not re.match(r'^[a-f0-9]{32}$', job_id):
+        return jsonify({'error': 'Invalid job id'}), 400
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({k: v for k, v in job.items() if v is not None})
+
+
+BATCH_MAX_ITEMS = max(1, int(os.environ.get('BATCH_MAX_ITEMS', '200')))
+# Threads driving batch renders; with RENDER_PROCESSES each one waits on a
+# pool process, so the batch uses every render worker.
+BATCH_CONCURRENCY = max(1, RENDER_PROCESSES or JOB_WORKERS)
+_batch_executor = None
+_batch_lock = threading.Lock()
+
+
+def _batch_pool():
+    global _batch_executor
+    with _batch_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='batch')
+        return _batch_executor
+
+
+def parse_batch_request(data):
+    """Expand a batch body into a list of (text, settings) pairs, or an error string per bad item.
+
+    Accepts {"items": [{"text": ..., "settings": {...}}, ...]} and/or
+    {"settings": {...}, "texts": [...]}; top-level settings are shared and
+    per-item settings override them.
+    """
+    shared = data.get('settings') or {}
+    if not isinstance(shared, dict):
+        raise ValueError('settings must be an object')
+    items, texts = data.get('items') or [], data.get('texts') or []
+    if not isinstance(items, list):
+        raise ValueError('items must be a list')
+    if not isinstance(texts, list):
+        raise ValueError('texts must be a list')
+    raw_items = items + [{'text': t} for t in texts]
+    if not raw_items:
+        raise ValueError('No items provided')
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        raise ValueError(f'At most {BATCH_MAX_ITEMS} items per batch')
+    parsed = []
+    for item in raw_items:
+        if not isinstance(item, dict) or not isinstance(item.get('text'), str):
+            parsed.append('No text provided')
+            continue
+        overrides = item.get('settings') or {}
+        if not isinstance(overrides, dict):
+            parsed.append('settings must be an object')
+            continue
+        try:
+            parsed.append(parse_generate_request({**shared, **overrides, 'text': item['text']}))
+        except (TypeError, ValueError, AttributeError) as e:
+            parsed.append(f'Invalid settings: {e}')
+    return parsed
+
+
+def _render_batch_item(item, in_memory):
+    """Render one parsed batch item. Returns (filename or PDF bytes, None) or (None, error)."""
+    if isinstance(item, str):
+        return None, item
+    text, settings = item
+    try:
+        if not in_memory:
+            return render_cached(text, settings)[0], None
+        pdf = render_stream(text, settings)
+        if isinstance(pdf, str):
+            with open(pdf, 'rb') as f:
+                pdf = f.read()
+        return pdf, None
+    except Exception as e:
+        return None, str(e)
+
+
+@app.route('/api/generate/batch', methods=['POST'])
+def generate_batch():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'No items provided'}), 400
+    try:
+        items = parse_batch_request(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    pool = _batch_pool()
+    as_zip = request.args.get('format') == 'zip' or data.get('format') == 'zip'
+    if not as_zip:
+        futures = [pool.submit(_render_batch_item, item, False) for item in items]
+        manifest = []
+        for i, future in enumerate(futures):
+            filename, error = future.result()
+            manifest.append({'index': i, 'error': error} if error else {'index': i, 'filename': filename})
+        return jsonify({'items': manifest})
+
+    def entries():
+        manifest = []
+        results = iter_in_order(lambda item: pool.submit(_render_batch_item, item, True),
+                                items, BATCH_CONCURRENCY * 2)
+        for i, (pdf, error) in enumerate(results):
+            if error:
+                manifest.append({'index': i, 'error': error})
+                continue
+            name = f'document_{i+1}.pdf'
+            manifest.append({'index': i, 'file': name})
+            yield name, pdf
+        yield 'manifest.json', json.dumps({'items': manifest}, indent=2).encode('utf-8')
+
+    return Response(stream_zip(entries()), mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename=handwritten_batch.zip',
+    })
+
+
+SCAN_NOISE_AMPLITUDE = 6
+SCAN_NOISE_TILE = 256
+# Number of distinct cached noise tiles; a page picks one plus a random offset
+SCAN_NOISE_VARIANTS = 8
+
+
+@functools.lru_cache(maxsize=SCAN_NOISE_VARIANTS)
+def _scan_noise_tile(variant):
+    """Tileable 'L' noise texture, uniform in 128 +/- SCAN_NOISE_AMPLITUDE, built once per variant."""
+    from PIL import Image
+    rng = random.Random(variant)
+    span = 2 * SCAN_NOISE_AMPLITUDE + 1
+    low = 128 - SCAN_NOISE_AMPLITUDE
+    data = bytes(low + b % span for b in rng.randbytes(SCAN_NOISE_TILE * SCAN_NOISE_TILE))
+    return Image.frombytes('L', (SCAN_NOISE_TILE, SCAN_NOISE_TILE), data)
+
+
+def _tile_offsets(size, offset):
+    w, h = size
+    ox, oy = offset
+    for y in range(-oy, h, SCAN_NOISE_TILE):
+        for x in range(-ox, w, SCAN_NOISE_TILE):
+            yield x, y
+
+
+def _add_scan_noise(img, variant, offset):
+    """Add the tiled noise texture to an RGB image, the same amount on every channel."""
+    from PIL import Image, ImageChops
+    tile = _scan_noise_tile(variant)
+    layer = Image.new('L', img.size)
+    for x, y in _tile_offsets(img.size, offset):
+        layer.paste(tile, (x, y))
+    # add() computes a + b - 128, clipped to 0-255
+    return ImageChops.add(img, Image.merge('RGB', (layer, layer, layer)), scale=1.0, offset=-128)
+
+
+@metrics.timed('scan_effect')
+def apply_scan_effect(img, seed=None, single_pass=False):
+    """Apply scan effect: slight tilt, minor blur, subtle noise, light border shadow.
+
+    seed makes the tilt and noise reproducible. single_pass rotates with a
+    bilinear filter, whose interpolation provides the blur, instead of a
+    bicubic rotation followed by a separate Gaussian blur pass.
+    """
+    from PIL import Image, ImageFilter, ImageOps
+
+    rng = random.Random(seed)
     img = img.convert('RGB')
-    w, h = img.size
-    tilt_deg = random.uniform(0.5, 1.0)
-    rotated = img.rotate(-tilt_deg, expand=True, resample=Image.Resampling.BICUBIC)
-    rotated = rotated.filter(ImageFilter.GaussianBlur(radius=0.5))
-    
-    if has_numpy:
-        arr = np.array(rotated, dtype=np.uint8)
-        noise = np.random.randint(-6, 7, arr.shape, dtype=np.int16)
-        arr = np.clip(arr.astype(np.int16) + noise, 0, 255).astype(np.uint8)
-        out = Image.fromarray(arr)
+    tilt_deg = rng.uniform(0.5, 1.0)
+    if single_pass:
+        rotated = img.rotate(-tilt_deg, expand=True, resample=Image.Resampling.BILINEAR)
     else:
-        pixels = list(rotated.getdata())
-        noisy_pixels = []
-        for r, g, b in pixels:
-            n = random.uniform(-6, 6)
-            r = max(0, min(255, int(r + n)))
-            g = max(0, min(255, int(g + n)))
-            b = max(0, min(255, int(b + n)))
-            noisy_pixels.append((r, g, b))
-        out = Image.new('RGB', rotated.size)
-        out.putdata(noisy_pixels)
-    
+        rotated = img.rotate(-tilt_deg, expand=True, resample=Image.Resampling.BICUBIC)
+        rotated = rotated.filter(ImageFilter.GaussianBlur(radius=0.5))
+
+    variant = rng.randrange(SCAN_NOISE_VARIANTS)
+    offset = (rng.randrange(SCAN_NOISE_TILE), rng.randrange(SCAN_NOISE_TILE))
+    out = _add_scan_noise(rotated, variant, offset)
+
     pad = 16
     out = ImageOps.expand(out, border=pad, fill=(238, 236, 232))
     return out
 
 
-def _pdf_to_image(filepath, page_index=0):
+EXPORT_DPI = 200
+EXPORT_DPI_RANGE = (36, 300)
+# Page rasterization for /api/export. EXPORT_PROCESSES=0 (the default)
+# rasterizes in the request thread; a number (or "auto") spreads pages over
+# that many worker processes. PyMuPDF is not thread-safe, hence processes.
+_export_processes = os.environ.get('EXPORT_PROCESSES', '0')
+EXPORT_PROCESSES = (os.cpu_count() or 1) if _export_processes == 'auto' else max(0, int(_export_processes))
+_export_executor = None
+_export_lock = threading.Lock()
+
+
+@metrics.timed('rasterize')
+def _pdf_to_image(filepath, page_index=0, dpi=EXPORT_DPI):
     """Convert a single PDF page to PIL Image."""
+    from PIL import Image
     import fitz  # PyMuPDF
     doc = fitz.open(filepath)
     try:
         page = doc[page_index]
-        zoom = 200 / 72  # 200 dpi
+        zoom = dpi / 72
         mat = fitz.Matrix(zoom, zoom)
         pix = page.get_pixmap(matrix=mat, alpha=False)
         img = Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
@@ -813,21 +817,174 @@ def _pdf_page_count(filepath):
         doc.close()
 
 
-def _pdf_all_pages_to_images(filepath):
-    """Convert all PDF pages to list of PIL Images."""
-    import fitz
-    doc = fitz.open(filepath)
-    images = []
+def _export_page(filepath, page_index, fmt, scan, dpi=EXPORT_DPI):
+    """Rasterize and encode one page. Returns (image bytes, scan effect error or None).
+
+    scan is None for a clean export, or keyword arguments for apply_scan_effect.
+    """
+    return encode_page_image(_pdf_to_image(filepath, page_index, dpi), page_index, fmt, scan)
+
+
+def encode_page_image(img, page_index, fmt, scan):
+    """Apply the scan effect (when scan is set) and encode a page image. Returns (bytes, error or None)."""
+    error = None
+    if scan is not None:
+        try:
+            if scan.get('seed') is not None:
+                # Distinct but reproducible noise on every page
+                scan = dict(scan, seed=scan['seed'] + page_index)
+            img = apply_scan_effect(img, **scan)
+        except Exception as e:
+            error = str(e)
+    buf = BytesIO()
+    if fmt == 'jpg':
+        img.save(buf, 'JPEG', quality=95)
+    else:
+        img.save(buf, 'PNG')
+    return buf.getvalue(), error
+
+
+def _export_pool():
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    global _export_executor
+    with _export_lock:
+        if _export_executor is None:
+            _export_executor = ProcessPoolExecutor(max_workers=EXPORT_PROCESSES,
+                                                   mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_export_executor.shutdown, cancel_futures=True)
+        return _export_executor
+
+
+def iter_exported_pages(filepath, page_indexes, fmt, scan, dpi=EXPORT_DPI, in_process=False):
+    """Yield (page_index, image bytes, error) in page order, one page at a time.
+
+    With EXPORT_PROCESSES set, pages are rendered in parallel but at most two
+    per worker are in flight, so memory stays around one page per worker.
+    in_process skips the pool (for profiling).
+    """
+    if in_process or not EXPORT_PROCESSES:
+        for i in page_indexes:
+            yield (i, *_export_page(filepath, i, fmt, scan, dpi))
+        return
+    pool = _export_pool()
+    results = iter_in_order(lambda i: pool.submit(_export_page, filepath, i, fmt, scan, dpi),
+                            page_indexes, EXPORT_PROCESSES * 2)
+    for i, (data, error) in zip(page_indexes, results):
+        yield i, data, error
+
+
+def parse_page_ranges(spec, page_count):
+    """Turn '1-3,7' into sorted zero-based page indexes; raises ValueError if malformed or out of range."""
+    indexes = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        start = int(first)
+        end = int(last) if sep else start
+        if start < 1 or end < start or end > page_count:
+            raise ValueError(f'Page range {part} is outside 1-{page_count}')
+        indexes.update(range(start - 1, end))
+    if not indexes:
+        raise ValueError('No pages selected')
+    return sorted(indexes)
+
+
+class _ZipSink:
+    """Write-only file object for zipfile that hands out what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive chunk by chunk from (name, bytes) pairs, one entry at a time."""
+    import zipfile
+    sink = _ZipSink()
+    # Page images are already compressed; deflating them again only costs CPU
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def parse_image_options(args):
+    """(scan, single, dpi) from the ?scan, ?scan_seed, ?scan_fast, ?single and ?dpi query options."""
+    scan = None
+    if args.get('scan', '0') == '1':
+        scan = {
+            'seed': parse_int(args.get('scan_seed'), None, 0, 2**31 - 1),
+            'single_pass': args.get('scan_fast', '0') == '1',
+        }
+    single = args.get('single', '0') == '1'
+    dpi = parse_int(args.get('dpi'), EXPORT_DPI, *EXPORT_DPI_RANGE)
+    return scan, single, dpi
+
+
+@app.route('/api/generate/images/<fmt>', methods=['POST'])
+def generate_images(fmt):
+    """Render text straight to page images with the direct raster backend, no PDF in between.
+
+    Same JSON body as /api/generate and the same query options as
+    /api/export (scan, scan_seed, scan_fast, dpi, pages, single).
+    """
+    if fmt not in ('jpg', 'png'):
+        return jsonify({'error': 'Invalid format'}), 400
+    data = request.get_json()
+    if not data or 'text' not in data:
+        return jsonify({'error': 'No text provided'}), 400
+    from raster import RasterDocument
+
+    text, settings = parse_generate_request(data)
+    if settings['deterministic']:
+        text, settings = seeded_inputs(text, settings)
+    scan, single, dpi = parse_image_options(request.args)
     try:
-        zoom = 200 / 72
-        mat = fitz.Matrix(zoom, zoom)
-        for page in doc:
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img = Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
-            images.append(img)
-        return images
-    finally:
-        doc.close()
+        doc = RasterDocument(text, settings, dpi)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    pages = request.args.get('pages')
+    try:
+        page_indexes = parse_page_ranges(pages, len(doc)) if pages else range(len(doc))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid pages: {e}'}), 400
+
+    if single:
+        page_index = page_indexes[0]
+        data, error = encode_page_image(doc.page_image(page_index), page_index, fmt, scan)
+        if error:
+            app.logger.warning(f'Scan effect failed on page {page_index+1}: {error}')
+        return send_file(BytesIO(data), mimetype='image/jpeg' if fmt == 'jpg' else 'image/png',
+                         as_attachment=True, download_name=f'handwritten_assignment_page_{page_index+1}.{fmt}')
+
+    logger = app.logger
+
+    def entries():
+        for i in page_indexes:
+            data, error = encode_page_image(doc.page_image(i), i, fmt, scan)
+            if error:
+                logger.warning(f'Scan effect failed on page {i+1}: {error}')
+            yield f'page_{i+1}.{fmt}', data
+
+    return Response(stream_zip(entries()), mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename=handwritten_assignment_all_pages.zip',
+    })
 
 
 @app.route('/api/export/<filename>/<fmt>')
@@ -839,103 +996,258 @@ def export_file(filename, fmt):
     filepath = os.path.join(GENERATED_DIR, filename)
     if not os.path.exists(filepath):
         return jsonify({'error': 'File not found'}), 404
-    scan_effect = request.args.get('scan', '0') == '1'
+    scan, single, dpi = parse_image_options(request.args)
+    try:
+        profile = profile_requested()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
 
     try:
-        images = _pdf_all_pages_to_images(filepath)
+        page_count = _pdf_page_count(filepath)
     except ImportError:
         return jsonify({'error': 'Install pymupdf: pip install pymupdf'}), 501
     except Exception as e:
         app.logger.error(f'Export error: {e}')
         return jsonify({'error': f'Export failed: {str(e)}'}), 500
 
-    if not images:
+    if not page_count:
         return jsonify({'error': 'No pages in PDF'}), 500
 
-    ext = 'jpg' if fmt == 'jpg' else 'png'
-    zip_buf = BytesIO()
-    with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for i, img in enumerate(images):
-            if scan_effect:
-                try:
-                    img = apply_scan_effect(img)
-                except Exception as e:
-                    app.logger.warning(f'Scan effect failed on page {i+1}: {e}')
-            page_buf = BytesIO()
-            if fmt == 'jpg':
-                img.save(page_buf, 'JPEG', quality=95)
+    pages = request.args.get('pages')
+    try:
+        page_indexes = parse_page_ranges(pages, page_count) if pages else range(page_count)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid pages: {e}'}), 400
+
+    if single:
+        page_index = page_indexes[0]
+        profile_id = None
+        try:
+            if profile:
+                profile_id, (data, error) = run_profiled(_export_page, filepath, page_index, fmt, scan, dpi)
             else:
-                img.save(page_buf, 'PNG')
-            page_buf.seek(0)
-            zf.writestr(f'page_{i+1}.{ext}', page_buf.getvalue())
-    zip_buf.seek(0)
-    return send_file(zip_buf, mimetype='application/zip', as_attachment=True,
-                     download_name='handwritten_assignment_all_pages.zip')
+                data, error = _export_page(filepath, page_index, fmt, scan, dpi)
+        except Exception as e:
+            app.logger.error(f'Export error: {e}')
+            return jsonify({'error': f'Export failed: {str(e)}'}), 500
+        if error:
+            app.logger.warning(f'Scan effect failed on page {page_index+1}: {error}')
+        response = send_file(BytesIO(data), mimetype='image/jpeg' if fmt == 'jpg' else 'image/png',
+                             as_attachment=True, download_name=f'handwritten_assignment_page_{page_index+1}.{fmt}')
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    logger = app.logger
+
+    def entries():
+        for i, data, error in iter_exported_pages(filepath, page_indexes, fmt, scan, dpi, in_process=profile):
+            if error:
+                logger.warning(f'Scan effect failed on page {i+1}: {error}')
+            yield f'page_{i+1}.{fmt}', data
+
+    headers = {'Content-Disposition': 'attachment; filename=handwritten_assignment_all_pages.zip'}
+    if profile:
+        # Build the whole ZIP inside the profiler instead of while streaming it
+        try:
+            profile_id, body = run_profiled(lambda: b''.join(stream_zip(entries())))
+        except Exception as e:
+            app.logger.error(f'Export error: {e}')
+            return jsonify({'error': f'Export failed: {str(e)}'}), 500
+        headers['X-Profile-Id'] = profile_id
+        return Response(body, mimetype='application/zip', headers=headers)
+    return Response(stream_zip(entries()), mimetype='application/zip', headers=headers)
 
 
-@app.route('/api/auto-structure', methods=['POST'])
-def auto_structure():
-    """Restructure pasted text into proper heading, numbered questions, paragraphs."""
-    data = request.get_json()
-    if not data or 'text' not in data:
-        return jsonify({'error': 'No text provided'}), 400
-    text = (data['text'] or '').strip()
-    if not text:
-        return jsonify({'structured': ''})
-    lines = text.split('\n')
+_CONTINUES_AFTER = re.compile(r'^(Ans|Answer|Q\d+)', re.IGNORECASE)
+
+
+def structure_text(text):
+    """Keep structural lines as they are and join wrapped paragraph lines back together."""
     out = []
-    i = 0
-    while i < len(lines):
-        line = lines[i]
+    for line in text.split('\n'):
         stripped = line.strip()
         if not stripped:
             out.append('')
-            i += 1
-            continue
-        upper = stripped.upper()
-        if any(kw in upper for kw in ['ASSIGNMENT', 'HOMEWORK', 'HOME WORK']):
-            out.append(stripped)
-            i += 1
-            continue
-        if re.match(r'^(NAME|STUDENT|ID|ROLL|DATE|SUBJECT|COURSE|CLASS)\s*[:.]', stripped, re.IGNORECASE):
-            out.append(stripped)
-            i += 1
-            continue
-        if re.match(r'^\d+[\.\)]\s+', stripped) or re.match(r'^(Q\d+|Question\s+\d+)', stripped, re.IGNORECASE):
-            out.append(stripped)
-            i += 1
-            continue
-        if re.match(r'^(Ans|Answer|A)\s*[:.\)]\s*', stripped, re.IGNORECASE):
-            out.append(stripped)
-            i += 1
             continue
-        if stripped.startswith('#'):
+        if line_kind(stripped) != 'answer' or 'HOME WORK' in stripped.upper():
             out.append(stripped)
-            i += 1
             continue
-        if out and out[-1] and not out[-1].strip().endswith(('.', '!', '?')) and not re.match(r'^(Ans|Answer|Q\d+)', out[-1], re.I):
+        if out and out[-1] and not out[-1].strip().endswith(('.', '!', '?')) and not _CONTINUES_AFTER.match(out[-1]):
             out[-1] = out[-1] + ' ' + stripped
         else:
             out.append(stripped)
-        i += 1
-    result = '\n'.join(out)
-    return jsonify({'structured': result})
+    return '\n'.join(out)
+
+
+@app.route('/api/auto-structure', methods=['POST'])
+def auto_structure():
+    """Restructure pasted text into proper heading, numbered questions, paragraphs."""
+    data = request.get_json()
+    if not data or 'text' not in data:
+        return jsonify({'error': 'No text provided'}), 400
+    text = (data['text'] or '').strip()
+    if not text:
+        return jsonify({'structured': ''})
+    return jsonify({'structured': structure_text(text)})
+
+
+PREVIEW_MAX_CHARS = 50000
+PREVIEW_CACHE_DOCS = max(1, int(os.environ.get('PREVIEW_CACHE_DOCS', '512')))
+# (session id, doc id) -> {'revision': ..., 'lengths': array of chars per line}, least recently used first.
+# An array('I') keeps a 50k-line document at 200 KB instead of a list of ints.
+_preview_docs = OrderedDict()
+_preview_lock = threading.Lock()
+
+
+# Lines longer than this are classified on every request rather than cached,
+# which keeps the cache under 8192 * PREVIEW_CACHE_LINE_CHARS characters.
+PREVIEW_CACHE_LINE_CHARS = 1024
+
+
+def _classify_preview_line(line):
+    line_type, content = classify_line(sanitize_text(line))
+    return {'type': line_type, 'content': content}
+
+
+_cached_preview_line = functools.lru_cache(maxsize=8192)(_classify_preview_line)
+
+
+def _preview_line(line):
+    if len(line) > PREVIEW_CACHE_LINE_CHARS:
+        return _classify_preview_line(line)
+    return _cached_preview_line(line)
+
+
+def _preview_key(doc_id):
+    if 'preview_sid' not in session:
+        session['preview_sid'] = uuid.uuid4().hex
+    return session['preview_sid'], doc_id
+
+
+def _remember_preview(key, revision, lengths):
+    with _preview_lock:
+        _preview_docs[key] = {'revision': revision, 'lengths': array('I', lengths)}
+        _preview_docs.move_to_end(key)
+        while len(_preview_docs) > PREVIEW_CACHE_DOCS:
+            _preview_docs.popitem(last=False)
+
+
+def apply_preview_changes(lengths, changes):
+    """Validate line splices against a cached document and apply them to its line lengths.
+
+    Each change is {"start": i, "delete": n, "lines": [...]}, applied in order.
+    Returns (new lengths, [(start, delete, lines)]); raises ValueError on bad input.
+    """
+    lengths = list(lengths)
+    splices = []
+    for change in changes:
+        if not isinstance(change, dict):
+            raise ValueError('Invalid change')
+        start, delete, lines = change.get('start'), change.get('delete', 0), change.get('lines', [])
+        if (not isinstance(start, int) or not isinstance(delete, int) or not isinstance(lines, list)
+                or not all(isinstance(line, str) for line in lines)
+                or start < 0 or delete < 0 or start + delete > len(lengths)):
+            raise ValueError('Invalid change')
+        lengths[start:start + delete] = [len(line) for line in lines]
+        splices.append((start, delete, lines))
+    if sum(lengths) + len(lengths) - 1 > PREVIEW_MAX_CHARS:
+        raise ValueError('Text too long')
+    return lengths, splices
 
 
 @app.route('/api/preview', methods=['POST'])
 def preview():
+    """Classify lines for the live preview.
+
+    Full mode takes {"text": ...}. Adding "doc_id" and "revision" lets the
+    client follow up with incremental requests {"doc_id", "base_revision",
+    "revision", "changes": [{"start", "delete", "lines"}]}; only the changed
+    lines are classified and the reply carries the same splices with
+    classified lines. A 409 asks the client to resend the full text.
+    """
     data = request.get_json()
-    if not data or 'text' not in data:
+    if not data:
         return jsonify({'error': 'No text provided'}), 400
+    doc_id = data.get('doc_id')
+    if doc_id is not None and (not isinstance(doc_id, str) or len(doc_id) > 64):
+        return jsonify({'error': 'Invalid doc_id'}), 400
+
+    if 'changes' in data:
+        if doc_id is None or not isinstance(data['changes'], list):
+            return jsonify({'error': 'Incremental preview needs doc_id and changes'}), 400
+        key = _preview_key(doc_id)
+        with _preview_lock:
+            doc = _preview_docs.get(key)
+        if doc is None or doc['revision'] != data.get('base_revision'):
+            return jsonify({'error': 'Preview out of sync', 'resync': True}), 409
+        try:
+            lengths, splices = apply_preview_changes(doc['lengths'], data['changes'])
+        except ValueError as e:
+            return jsonify({'error': str(e), 'resync': True}), 409
+        revision = data.get('revision')
+        _remember_preview(key, revision, lengths)
+        return jsonify({
+            'revision': revision,
+            'changes': [{'start': start, 'delete': delete, 'lines': [_preview_line(line) for line in lines]}
+                        for start, delete, lines in splices],
+        })
+
+    if 'text' not in data:
+        return jsonify({'error': 'No text provided'}), 400
+
+    lines = data['text'][:PREVIEW_MAX_CHARS].split('\n')
+    preview_lines = [_preview_line(line) for line in lines]
+    if doc_id is None:
+        return jsonify({'lines': preview_lines})
+    revision = data.get('revision')
+    _remember_preview(_preview_key(doc_id), revision, [len(line) for line in lines])
+    return jsonify({'lines': preview_lines, 'revision': revision})
 
-    text = sanitize_text(data['text'][:50000])
-    lines = text.split('\n')
-    preview_lines = []
-    for line in lines:
-        line_type, content = classify_line(line)
-        preview_lines.append({'type': line_type, 'content': content})
 
-    return jsonify({'lines': preview_lines})
+@app.before_request
+def _start_sweeper():
+    """Start the sweeper on the first write, for servers started without create_app() (gunicorn app:app)."""
+    if request.method == 'POST' and not SERVERLESS:
+        start_background_tasks()
+
+
+@app.before_request
+def _begin_request_metrics():
+    if metrics.ENABLED:
+        g.metrics_start = time.perf_counter()
+        metrics.begin_request()
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    """Server-Timing header with the request's stages and counts; route latency once the body is sent."""
+    if not metrics.ENABLED or 'metrics_start' not in g:
+        return response
+    totals = metrics.request_totals()
+    if totals and (totals['stages'] or totals['counts']):
+        timings = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in totals['stages'].items()]
+        timings += [f'{name};desc="{value}"' for name, value in totals['counts'].items()]
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+    start = g.metrics_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+
+    def finish():
+        # Streamed responses (exports, ZIPs) do their work while the body is sent
+        metrics.end_request()
+        metrics.observe('request_seconds', time.perf_counter() - start, route=route, method=method)
+    response.call_on_close(finish)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint (METRICS=1)."""
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Metrics are disabled; set METRICS=1'}), 404
+    return Response(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/generated/<filename>')
@@ -945,5 +1257,22 @@ def serve_generated(filename):
     return send_from_directory(GENERATED_DIR, filename)
 
 
+def create_app():
+    """Application factory for long-running servers.
+
+    Importing this module only defines the routes: fonts, ReportLab, Pillow
+    and PyMuPDF load on first use and no threads start, which keeps cold
+    starts cheap for serverless handlers. A long-running server
+    (gunicorn 'app:create_app()', python app.py) reads the font index up
+    front and runs the cache sweeper. One that imports app directly still
+    starts the sweeper on its first POST, unless SERVERLESS.
+    """
+    available_fonts()
+    if os.environ.get('FONT_PRELOAD') == '1':
+        preload_fonts()
+    start_background_tasks()
+    return app
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    create_app().run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,126 @@
+"""
+Ink palette benchmark: per-request InkPalette vs building a fresh Color for every word.
+
+The original realistic renderer parsed the ink hex, applied ink flow and gel
+pen and drew three random offsets for every word, so almost every word got
+its own fill color operator. First checks that every palette color stays
+within the range the original could produce at the same word position, then
+renders the same seeded essay both ways and compares fill operators in the
+content streams, PDF size and render time.
+
+Run from the project root:  python benchmarks/bench_ink_palette.py
+"""
+import os
+import random
+import re
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reportlab import rl_config  # noqa: E402
+from reportlab.lib.colors import Color, HexColor  # noqa: E402
+
+import rendering  # noqa: E402
+
+ESSAY = ("Newton's second law describes how the velocity of an object changes when it is "
+         "subjected to an external force, and the resulting acceleration is proportional to it. ") * 150
+
+CASES = {
+    'default': {},
+    'gel_pen': {'ink_color': '#1B5E20', 'gel_pen': True},
+    'no_ink_flow': {'ink_color': '#B71C1C', 'ink_flow': False},
+}
+
+
+def reference_ink_color(base_hex, position_ratio, ink_flow, gel_pen, rng=random):
+    """The original per-word color: fade, gel pen and fresh noise every call."""
+    base = HexColor(base_hex)
+    r, g, b = base.red, base.green, base.blue
+    if ink_flow:
+        fade = 1.0 - (position_ratio * 0.12)
+        r, g, b = r * fade, g * fade, b * fade
+    if gel_pen:
+        r = min(1, r * 1.08)
+        g = min(1, g * 1.02)
+        b = min(1, b * 0.95)
+    r = min(1, max(0, r + rng.uniform(-0.02, 0.02)))
+    g = min(1, max(0, g + rng.uniform(-0.02, 0.02)))
+    b = min(1, max(0, b + rng.uniform(-0.02, 0.02)))
+    return Color(r, g, b)
+
+
+def reference_renderer(settings):
+    """draw_realistic_text with the original per-word color in place of the palette."""
+    draw = rendering.draw_realistic_text
+    ink_color = settings.get('ink_color', '#0A1F5C')
+
+    class PerWordInk:
+        def ramp(self, rng=random):
+            return self
+
+        def __getitem__(self, level):
+            return reference_ink_color(ink_color, level / rendering.INK_FADE_LEVELS, settings.get('ink_flow', True),
+                                       settings.get('gel_pen', False), self.rng)
+
+    def draw_realistic_text(c, text, x, y, font_name, font_size, ink, realistic_settings, max_width=None, rng=None):
+        per_word = PerWordInk()
+        per_word.rng = rng
+        return draw(c, text, x, y, font_name, font_size, per_word, realistic_settings, max_width, rng)
+    return draw_realistic_text
+
+
+def check_palette_range(settings):
+    """Every palette color is within 0.02 (noise) plus one fade step of the original color for its level."""
+    ink_flow, gel_pen = settings.get('ink_flow', True), settings.get('gel_pen', False)
+    palette = rendering.InkPalette(settings.get('ink_color', '#0A1F5C'), ink_flow, gel_pen, random.Random(1))
+    still = random.Random()
+    still.uniform = lambda a, b: 0.0
+    step = 0.12 / rendering.INK_FADE_LEVELS
+    for ramp in palette.ramps:
+        assert len(ramp) == rendering.INK_FADE_LEVELS
+        for level, color in enumerate(ramp):
+            for position in (level / rendering.INK_FADE_LEVELS, (level + 1) / rendering.INK_FADE_LEVELS):
+                expected = reference_ink_color(settings.get('ink_color', '#0A1F5C'), position, ink_flow, gel_pen, still)
+                for got, want in zip(color.rgb(), expected.rgb()):
+                    assert abs(got - want) <= 0.02 + step + 1e-9, (level, got, want)
+
+
+def render(settings, reference=False, compress=True):
+    current = rendering.draw_realistic_text
+    if reference:
+        rendering.draw_realistic_text = reference_renderer(settings)
+    rl_config.pageCompression = int(compress)
+    try:
+        return rendering.generate_pdf(ESSAY, settings, BytesIO()).getvalue()
+    finally:
+        rendering.draw_realistic_text = current
+        rl_config.pageCompression = 1
+
+
+def _best_of(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    font_name = rendering.resolve_font({'font': 'ComicNeue'})
+    for name, overrides in CASES.items():
+        settings = {'font': font_name, 'page_style': 'blank', 'seed': 1, **overrides}
+        check_palette_range(settings)
+        print(f'{name}: every palette color within the original per-word range')
+        for label, reference in (('per word', True), ('palette', False)):
+            raw = render(settings, reference, compress=False)
+            fills = len(re.findall(rb' rg\b', raw))
+            size = len(render(settings, reference))
+            elapsed = _best_of(lambda: render(settings, reference))
+            print(f'  {label:9s} {fills:6d} fill colors  {size / 1024:7.1f} KiB  {elapsed * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Raster benchmark: direct glyph-atlas rendering vs rendering a PDF and rasterizing it with PyMuPDF.
+
+The PDF path is what /api/generate followed by /api/export does: generate_pdf,
+then PyMuPDF opens the PDF and rasterizes every page. The direct path is
+/api/generate/images: RasterDocument lays the same seeded document out and
+draws each page onto a bitmap. Both produce RGB page images at the same DPI;
+PNG encoding is left out since both paths share it.
+
+First checks that the two agree at each DPI: pages are the same size,
+every dark (ink) pixel of one lies within 2 px of ink in the other, and the
+mean per-channel difference is small.
+
+Run from the project root:  python benchmarks/bench_raster.py [--dpi 100 200]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image, ImageFilter  # noqa: E402
+
+import raster  # noqa: E402
+import rendering  # noqa: E402
+
+ESSAY = """HOME ASSIGNMENT 2
+Name: Jane Doe
+Subject: History
+
+Q1. Describe the effects of the industrial revolution on city life.
+Ans: Factories drew workers from the countryside, and cities grew faster than housing could be built.
+""" + ("Working hours were set by the factory clock, children often worked alongside adults, and new "
+       "railways carried goods and people further than ever before. ") * 120
+
+CASES = {
+    'blank': {},
+    'notebook': {'page_style': 'notebook'},
+    'grain': {'page_style': 'grain'},
+    'jittered': {'word_size_variation': False, 'baseline_shift': False, 'ink_flow': False},
+}
+
+
+def via_pdf(settings, dpi):
+    pdf = rendering.generate_pdf(ESSAY, settings, BytesIO()).getvalue()
+    doc = fitz.open(stream=pdf)
+    matrix = fitz.Matrix(dpi / 72, dpi / 72)
+    images = []
+    for page in doc:
+        pix = page.get_pixmap(matrix=matrix, alpha=False)
+        images.append(Image.frombytes('RGB', (pix.width, pix.height), pix.samples))
+    return images
+
+
+def direct(settings, dpi):
+    doc = raster.RasterDocument(ESSAY, settings, dpi)
+    return [doc.page_image(i) for i in range(len(doc))]
+
+
+def _ink(img):
+    return np.asarray(img.convert('L')) < 140
+
+
+def _near(mask):
+    return np.asarray(Image.fromarray(mask.astype('uint8') * 255).filter(ImageFilter.MaxFilter(5))) > 0
+
+
+def check_same_pages(settings, dpi):
+    reference, images = via_pdf(settings, dpi), direct(settings, dpi)
+    assert len(reference) == len(images)
+    worst = 0.0
+    for a, b in zip(reference, images):
+        assert a.size == b.size
+        ink_a, ink_b = _ink(a), _ink(b)
+        assert (ink_a & ~_near(ink_b)).sum() <= ink_a.sum() * 0.001, 'ink missing from the direct render'
+        assert (ink_b & ~_near(ink_a)).sum() <= ink_b.sum() * 0.001, 'ink the PDF does not have'
+        worst = max(worst, np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).mean())
+    return len(images), worst
+
+
+def _best_of(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dpi', type=int, nargs='+', default=[100, 200])
+    args = parser.parse_args()
+    rendering.resolve_font({'font': 'ComicNeue'})
+
+    start = time.perf_counter()
+    direct({'font': 'ComicNeue', 'seed': 0}, args.dpi[0])
+    print(f'first direct render (atlases empty): {(time.perf_counter() - start) * 1000:.1f} ms')
+    for dpi in args.dpi:
+        for name, overrides in CASES.items():
+            settings = {'font': 'ComicNeue', 'seed': 1, **overrides}
+            pages, diff = check_same_pages(settings, dpi)
+            print(f'{name}: {pages} pages at {dpi} dpi, ink matches within 2 px, mean difference {diff:.2f}/255')
+            for label, fn in (('PDF + PyMuPDF', via_pdf), ('direct', direct)):
+                elapsed = _best_of(lambda: fn(settings, dpi))
+                print(f'  {label:14s} {elapsed * 1000:8.1f} ms  ({pages / elapsed:5.1f} pages/s)')
+
+
+if __name__ == '__main__':
+    main()
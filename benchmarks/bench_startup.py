@@ -0,0 +1,89 @@
+"""
+Startup benchmark: how long `import app` takes in a fresh interpreter, and what it pulls in.
+
+Imports the app in new processes under `python -X importtime`, reports the
+median import time with the slowest top-level imports, and checks that
+importing alone stays cheap: no ReportLab canvas, Pillow, PyMuPDF or
+process-pool imports, no font parsing and no background threads (those
+belong to create_app() and the first request that needs them).
+
+Exits non-zero when the median import time exceeds the budget.
+
+Run from the project root:  python benchmarks/bench_startup.py [--budget-ms 250] [--runs 7]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+DEFERRED_MODULES = ('reportlab.pdfgen.canvas', 'reportlab.pdfbase.ttfonts', 'reportlab.lib.colors',
+                    'PIL.Image', 'fitz', 'concurrent.futures.process', 'multiprocessing')
+
+PROBE = f"""
+import json, sys, threading
+import app, rendering
+print(json.dumps({{
+    'loaded': [m for m in {DEFERRED_MODULES!r} if m in sys.modules],
+    'threads': threading.active_count(),
+    'fonts_indexed': rendering._fonts_indexed,
+    'fonts_loaded': len(rendering.FONT_WIDTH_TABLES),
+}}))
+"""
+
+
+def import_times():
+    """(name, depth, cumulative us) for every import of one `import app`."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(cumulative)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', '250')))
+    parser.add_argument('--runs', type=int, default=7)
+    args = parser.parse_args()
+
+    probe = json.loads(subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True,
+                                      text=True, check=True).stdout)
+    problems = []
+    if probe['loaded']:
+        problems.append(f"import pulled in {', '.join(probe['loaded'])}")
+    if probe['threads'] != 1:
+        problems.append(f"import started {probe['threads'] - 1} thread(s)")
+    if probe['fonts_indexed'] or probe['fonts_loaded']:
+        problems.append('import read the font index or loaded fonts')
+
+    import_times()  # first run writes the bytecode cache
+    runs = sorted((import_times() for _ in range(args.runs)),
+                  key=lambda rows: next(us for name, _, us in rows if name == 'app'))
+    median = runs[len(runs) // 2]
+    total_ms = next(us for name, _, us in median if name == 'app') / 1000
+    spread = [next(us for name, _, us in rows if name == 'app') / 1000 for rows in runs]
+    print(f'import app  median {total_ms:6.1f} ms  (min {min(spread):.1f}, max {max(spread):.1f}, '
+          f'stdev {statistics.pstdev(spread):.1f}) over {args.runs} runs, budget {args.budget_ms:.0f} ms')
+    print('slowest imports under app:')
+    children = [(us, name) for name, depth, us in median if depth == 1]
+    for us, name in sorted(children, reverse=True)[:8]:
+        print(f'  {us / 1000:6.1f} ms  {name}')
+
+    if total_ms > args.budget_ms:
+        problems.append(f'median import time {total_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget')
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark suite for the rendering pipeline, with JSON results to compare between commits.
+
+Scenarios:
+  corpus/<name>         generate_pdf on each standard corpus, default settings
+  page_style/<style>    the homework corpus on every draw_page_background style
+  realism/<path>        the 50k essay through each text renderer generate_pdf can
+                        pick: realistic (per-word size/baseline/ink), jittered
+                        (per-character), plain with ink variation, plain
+  export/<fmt>[+scan]   GET /api/export of five pages of the many-questions PDF
+                        as png/jpg, with and without scan=1
+  images/<fmt>[+scan]   the same five pages from POST /api/generate/images, which
+                        lays the text out and rasterizes it directly, no PDF
+  preview/full          POST /api/preview of the 50k essay with a cold cache
+  preview/incremental   100 single-line edits of the essay through incremental previews
+
+Every scenario runs in a fresh process, so peak RSS is that scenario's own.
+Each reports the median wall time over --repeat runs, pages/sec for renders,
+peak RSS and output bytes. Renders are seeded, so output bytes only change
+when the output does.
+
+Run from the project root:
+  python benchmarks/bench_suite.py [--only export] [--repeat 3] [--out results.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+HOMEWORK = """HOME ASSIGNMENT 4
+Name: Jane Doe
+Roll No: 42
+Subject: Physics
+Date: 12/03/2024
+
+Q1. State Newton's three laws of motion.
+Ans: A body stays at rest or in uniform motion unless a force acts on it. Force equals the rate of change of momentum. Every action has an equal and opposite reaction.
+
+Q2. Define work and power.
+Ans: Work is force times displacement along the force. Power is the rate of doing work, measured in watts.
+
+# Short notes
+Momentum is conserved in every collision when no external force acts on the system.
+"""
+
+_PARAGRAPH = ("The industrial revolution transformed how goods were produced, moving work from homes and small "
+              "workshops into factories powered first by water and then by steam. Cities grew quickly as people "
+              "followed the new jobs, and the pace of daily life came to be set by the factory clock. ")
+
+CORPORA = {
+    'homework': HOMEWORK,
+    'essay_50k': '\n\n'.join(_PARAGRAPH * 3 for _ in range(50000 // (len(_PARAGRAPH) * 3 + 2) + 1))[:50000],
+    'many_questions': ''.join(f'Q{n}. What is the value of {n} squared?\nAns: {n} squared is {n * n}.\n\n'
+                              for n in range(1, 401)),
+    'long_paragraphs': '\n'.join(_PARAGRAPH * 40 for _ in range(4)),
+}
+
+REALISM = {
+    'realistic': {},
+    'jittered': {'word_size_variation': False, 'baseline_shift': False, 'ink_flow': False},
+    'plain_ink': {'spacing_variation': False, 'jitter': False},
+    'plain': {'spacing_variation': False, 'jitter': False, 'ink_variation': False, 'ink_flow': False},
+}
+
+BASE_SETTINGS = {'font': 'ComicNeue', 'seed': 1}
+EXPORT_PAGES = 5
+
+
+def _page_count(pdf):
+    return len(re.findall(rb'/Type /Page\b', pdf))
+
+
+def _render(corpus, **settings):
+    def run():
+        import rendering
+        pdf = rendering.generate_pdf(CORPORA[corpus], dict(BASE_SETTINGS, **settings), BytesIO()).getvalue()
+        return _page_count(pdf), len(pdf)
+    return run
+
+
+def _export(fmt, scan):
+    def setup():
+        import app
+        client = app.create_app().test_client()
+        filename = app.generate_pdf(CORPORA['many_questions'], dict(BASE_SETTINGS))
+        query = f'?pages=1-{EXPORT_PAGES}' + ('&scan=1&scan_seed=1' if scan else '')
+
+        def run():
+            response = client.get(f'/api/export/{filename}/{fmt}{query}')
+            assert response.status_code == 200, response.status_code
+            return EXPORT_PAGES, len(response.data)
+
+        def cleanup():
+            os.remove(os.path.join(app.GENERATED_DIR, filename))
+        return run, cleanup
+    return setup
+
+
+def _images(fmt, scan):
+    def setup():
+        import app
+        client = app.create_app().test_client()
+        body = {'text': CORPORA['many_questions'], 'font': BASE_SETTINGS['font'], 'deterministic': True}
+        query = f'?pages=1-{EXPORT_PAGES}' + ('&scan=1&scan_seed=1' if scan else '')
+
+        def run():
+            response = client.post(f'/api/generate/images/{fmt}{query}', json=body)
+            assert response.status_code == 200, response.status_code
+            return EXPORT_PAGES, len(response.data)
+        return run, None
+    return setup
+
+
+def _preview(incremental):
+    def setup():
+        import app
+        client = app.create_app().test_client()
+        text = CORPORA['essay_50k']
+        lines = text.split('\n')
+
+        def run_full():
+            app._cached_preview_line.cache_clear()
+            response = client.post('/api/preview', json={'text': text})
+            assert response.status_code == 200, response.status_code
+            return None, len(response.data)
+
+        def run_incremental():
+            client.post('/api/preview', json={'text': text, 'doc_id': 'bench', 'revision': 0})
+            size = 0
+            for revision in range(1, 101):
+                index = revision % len(lines)
+                # Same-length edits keep the essay under the preview size limit
+                edited = lines[index].swapcase() if revision % 2 else lines[index]
+                change = {'start': index, 'delete': 1, 'lines': [edited]}
+                response = client.post('/api/preview', json={'doc_id': 'bench', 'base_revision': revision - 1,
+                                                             'revision': revision, 'changes': [change]})
+                assert response.status_code == 200, response.status_code
+                size += len(response.data)
+            return None, size
+        return (run_incremental if incremental else run_full), None
+    return setup
+
+
+def scenarios():
+    """name -> setup(), which returns (run, cleanup); run() returns (pages or None, output bytes)."""
+    from rendering import PAGE_STYLES
+    def plain(run):
+        return lambda: (run, None)
+
+    found = {}
+    for corpus in CORPORA:
+        found[f'corpus/{corpus}'] = plain(_render(corpus))
+    for style in PAGE_STYLES:
+        found[f'page_style/{style}'] = plain(_render('homework', page_style=style))
+    for path, overrides in REALISM.items():
+        found[f'realism/{path}'] = plain(_render('essay_50k', **overrides))
+    for fmt in ('png', 'jpg'):
+        found[f'export/{fmt}'] = _export(fmt, scan=False)
+        found[f'export/{fmt}+scan'] = _export(fmt, scan=True)
+        found[f'images/{fmt}'] = _images(fmt, scan=False)
+        found[f'images/{fmt}+scan'] = _images(fmt, scan=True)
+    found['preview/full'] = _preview(incremental=False)
+    found['preview/incremental'] = _preview(incremental=True)
+    return found
+
+
+def run_scenario(name, repeat):
+    """Run one scenario in this process; returns its result dict."""
+    import rendering
+    rendering.resolve_font(BASE_SETTINGS)
+    run, cleanup = scenarios()[name]()
+    times = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pages, size = run()
+            times.append(time.perf_counter() - start)
+    finally:
+        if cleanup:
+            cleanup()
+    wall = statistics.median(times)
+    return {
+        'name': name,
+        'wall_s': round(wall, 4),
+        'pages': pages,
+        'pages_per_s': round(pages / wall, 2) if pages else None,
+        # ru_maxrss is KiB on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'bytes': size,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    old = {r['name']: r for r in baseline['results']}
+    print(f"\n{'scenario':28s} {'wall':>9s} {'peak RSS':>9s} {'bytes':>9s}   vs {baseline.get('commit')}", file=sys.stderr)
+    for r in results:
+        b = old.get(r['name'])
+        if b is None:
+            continue
+        cells = [f"{r[key] / b[key]:8.2f}x" if b[key] else f"{'-':>9s}" for key in ('wall_s', 'peak_rss_kb', 'bytes')]
+        print(f"{r['name']:28s} {' '.join(cells)}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--only', help='run scenarios whose name contains this')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario; the median is reported')
+    parser.add_argument('--out', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', help='print ratios against an earlier results file')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)  # child process mode
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args.scenario, args.repeat)))
+        return
+
+    names = [name for name in scenarios() if not args.only or args.only in name]
+    results = []
+    for name in names:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', name, '--repeat', str(args.repeat)],
+                               cwd=ROOT, capture_output=True, text=True)
+        if child.returncode:
+            sys.exit(f'{name} failed:\n{child.stderr}')
+        result = json.loads(child.stdout.splitlines()[-1])
+        results.append(result)
+        rate = f"{result['pages_per_s']:7.1f} pages/s" if result['pages_per_s'] else ' ' * 15
+        print(f"{name:28s} {result['wall_s'] * 1000:9.1f} ms  {rate}  {result['peak_rss_kb'] / 1024:6.1f} MiB  "
+              f"{result['bytes']:>10,} B", file=sys.stderr)
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
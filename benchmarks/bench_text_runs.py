@@ -0,0 +1,157 @@
+"""
+Text run benchmark: one PDF text object per line vs the original per-word drawString calls.
+
+Renders the same seeded documents through the current realism renderers and
+the original ones (which drew every word, space and jittered character with
+its own drawString), checks that both place every glyph at the same
+position, then compares file size, content stream size and render time.
+
+Run from the project root:  python benchmarks/bench_text_runs.py
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz  # noqa: E402
+from reportlab import rl_config  # noqa: E402
+
+import rendering  # noqa: E402
+
+ESSAY = ("Newton's second law describes how the velocity of an object changes when it is "
+         "subjected to an external force, and the resulting acceleration is proportional to it. ") * 150
+
+CASES = {
+    'realistic': {},
+    'jittered': {'word_size_variation': False, 'baseline_shift': False, 'ink_flow': False},
+}
+
+
+def reference_draw_jittered_text(c, text, x, y, font_name, font_size, max_width=None, rng=None):
+    """The original renderer: one drawString per character."""
+    start_x = x
+    current_y = y
+    line_height = font_size * 1.35
+    effective_max = (max_width - 4) if max_width else None
+    for char, cw in zip(text, rendering.glyph_widths(text, font_name, font_size)):
+        extra = rng.uniform(-0.2, 0.25)
+        if effective_max and (x - start_x) + cw + max(0, extra) > effective_max and (x > start_x):
+            x = start_x
+            current_y -= line_height
+            extra = 0
+        jx = rng.uniform(-0.4, 0.4)
+        jy = rng.uniform(-0.5, 0.5)
+        c.drawString(x + jx, current_y + jy, char)
+        x += cw + extra
+    return current_y
+
+
+def reference_draw_realistic_text(c, text, x, y, font_name, font_size, ink, settings, max_width=None, rng=None):
+    """The original renderer: color, font and drawString per word, plus a drawString per space."""
+    jitter_strength = settings.get('jitter_strength', 1.0)
+    words = text.split()
+    if not words:
+        return y
+    current_x = x
+    current_y = y
+    line_height = font_size * 1.4
+    effective_max = (max_width - 5) if max_width else None
+    ramp = ink.ramp(rng)
+    for i, word in enumerate(words):
+        c.setFillColor(ramp[i * rendering.INK_FADE_LEVELS // len(words)])
+        size = font_size
+        if settings.get('word_size_variation', True):
+            size = max(font_size - 1, min(font_size + 2, font_size + rng.uniform(-1.2, 1.5)))
+        c.setFont(font_name, size)
+        word_width = rendering.text_width(word, font_name, size)
+        space_width = rendering.text_width(' ', font_name, size) if current_x > x else 0
+        random_spacing = rng.uniform(-0.1, 0.2)
+        if effective_max and (current_x - x) + space_width + word_width + max(0, random_spacing) > effective_max:
+            if current_x > x:
+                current_x = x
+                current_y -= line_height
+                space_width = 0
+                random_spacing = 0
+            elif word_width > effective_max:
+                word = word[:max(1, int(len(word) * (effective_max - 2) / word_width))]
+                word_width = rendering.text_width(word, font_name, size)
+        by = current_y
+        if settings.get('baseline_shift', True):
+            by = current_y + rng.uniform(-1.2, 1.2) * jitter_strength
+        jx = rng.uniform(-0.5, 0.5) * jitter_strength if jitter_strength else 0
+        jy = rng.uniform(-0.5, 0.5) * jitter_strength if jitter_strength else 0
+        if current_x > x and space_width > 0:
+            c.drawString(current_x + jx, by + jy, ' ')
+            current_x += space_width
+        c.drawString(current_x + jx, by + jy, word)
+        current_x += word_width + random_spacing
+        if effective_max and (current_x - x) > effective_max:
+            current_x = x + effective_max
+    return current_y
+
+
+def render(settings, reference=False, compress=True):
+    current = rendering.draw_jittered_text, rendering.draw_realistic_text
+    if reference:
+        rendering.draw_jittered_text, rendering.draw_realistic_text = reference_draw_jittered_text, reference_draw_realistic_text
+    rl_config.pageCompression = int(compress)
+    try:
+        return rendering.generate_pdf(ESSAY, settings, BytesIO()).getvalue()
+    finally:
+        rendering.draw_jittered_text, rendering.draw_realistic_text = current
+        rl_config.pageCompression = 1
+
+
+def _glyph_origins(page):
+    """char -> [(x, y), ...] for every visible character on the page."""
+    origins = {}
+    for block in page.get_text('rawdict')['blocks']:
+        for line in block.get('lines', ()):
+            for span in line['spans']:
+                for ch in span['chars']:
+                    if not ch['c'].isspace():
+                        origins.setdefault(ch['c'], []).append(ch['origin'])
+    return origins
+
+
+def check_same_glyphs(settings):
+    old, new = fitz.open(stream=render(settings, reference=True)), fitz.open(stream=render(settings))
+    assert len(old) == len(new)
+    for old_page, new_page in zip(old, new):
+        new_glyphs = _glyph_origins(new_page)
+        for char, positions in _glyph_origins(old_page).items():
+            candidates = new_glyphs.pop(char)
+            assert len(positions) == len(candidates), char
+            for x0, y0 in positions:
+                match = next(i for i, (x1, y1) in enumerate(candidates) if abs(x0 - x1) < 0.1 and abs(y0 - y1) < 0.1)
+                del candidates[match]
+        assert not new_glyphs
+    return len(new)
+
+
+def _best_of(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    font_name = rendering.resolve_font({'font': 'ComicNeue'})
+    for name, overrides in CASES.items():
+        settings = {'font': font_name, 'page_style': 'blank', 'seed': 1, **overrides}
+        pages = check_same_glyphs(settings)
+        print(f'{name}: {pages} pages, every glyph at the same position')
+        for label, reference in (('drawString', True), ('text runs', False)):
+            size = len(render(settings, reference))
+            raw = len(render(settings, reference, compress=False))
+            elapsed = _best_of(lambda: render(settings, reference))
+            print(f'  {label:10s} {size / 1024:8.1f} KiB  ({raw / 1024:8.1f} KiB uncompressed)  {elapsed * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
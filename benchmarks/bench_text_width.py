@@ -0,0 +1,58 @@
+"""
+Text measurement benchmark: ReportLab stringWidth vs the precomputed advance tables.
+
+Replays the measurements wrap_text and the realism renderers make for a long
+essay (per word, per space, per character) through both paths.
+
+Run from the project root:  python benchmarks/bench_text_width.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reportlab.pdfbase import pdfmetrics  # noqa: E402
+
+import rendering  # noqa: E402
+
+ESSAY = ("The mitochondria is the powerhouse of the cell and converts nutrients "
+         "into adenosine triphosphate through oxidative phosphorylation. ") * 400
+
+
+def _measure(width_fn, font_name, words):
+    total = 0.0
+    for word in words:
+        total += width_fn(word, font_name, 18)
+        total += width_fn(' ', font_name, 18)
+        for ch in word:
+            total += width_fn(ch, font_name, 18)
+    return total
+
+
+def _best_of(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    font_name = rendering.resolve_font({'font': 'ComicNeue'})
+    words = ESSAY.split()
+    print(f'{len(ESSAY)} chars, {len(words)} words, font {font_name}')
+
+    reference = _best_of(lambda: _measure(pdfmetrics.stringWidth, font_name, words))
+    table = _best_of(lambda: _measure(rendering.text_width, font_name, words))
+    print(f'stringWidth   {reference * 1000:8.1f} ms')
+    print(f'text_width    {table * 1000:8.1f} ms  ({reference / table:.1f}x)')
+
+    settings = {'font': font_name, 'page_style': 'blank'}
+    elapsed = _best_of(lambda: os.remove(os.path.join(rendering.GENERATED_DIR, rendering.generate_pdf(ESSAY, settings))), repeat=3)
+    print(f'generate_pdf  {elapsed * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
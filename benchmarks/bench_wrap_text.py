@@ -0,0 +1,80 @@
+"""
+Line wrapping benchmark: incremental wrap_text vs the original prefix re-measuring wrapper.
+
+Checks that wrap_text produces exactly the lines of the original algorithm
+for every registered font before timing a long unbroken paragraph.
+
+Run from the project root:  python benchmarks/bench_wrap_text.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reportlab.pdfbase import pdfmetrics  # noqa: E402
+
+import rendering  # noqa: E402
+
+VOCABULARY = ("a an the cell membrane photosynthesis is of and Newton's second law "
+              "F=ma thermodynamics entropy 42 x² naïve café — electrochemistry "
+              "supercalifragilisticexpialidocious").split()
+
+
+def reference_wrap_text(text, font_name, font_size, max_width):
+    """The original quadratic wrapper: re-measures the whole line for every word."""
+    words = text.split()
+    lines = []
+    current_line = ''
+    safe_width = max_width * 0.85
+    for word in words:
+        test_line = f"{current_line} {word}".strip() if current_line else word
+        tw = pdfmetrics.stringWidth(test_line, font_name, font_size)
+        if tw <= safe_width:
+            current_line = test_line
+        else:
+            if current_line:
+                lines.append(current_line)
+            current_line = word
+    if current_line:
+        lines.append(current_line)
+    return lines if lines else ['']
+
+
+def check_correctness():
+    rng = random.Random(7)
+    cases = 0
+    for font_name in rendering.available_fonts():
+        rendering.load_font(font_name)
+        for _ in range(25):
+            text = ' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(0, 80)))
+            size = rng.choice([10, 14, 18, 19, 25, 36])
+            max_width = rng.uniform(40, 500)
+            expected = reference_wrap_text(text, font_name, size, max_width)
+            measured = rendering.wrap_text_measured(text, font_name, size, max_width)
+            assert [line for line, _ in measured] == expected, (font_name, text, size, max_width)
+            for line, width in measured:
+                assert abs(width - pdfmetrics.stringWidth(line, font_name, size)) < 1e-6
+            cases += 1
+    print(f'correctness: {cases} cases match the original wrapper')
+
+
+def main():
+    check_correctness()
+    font_name = rendering.resolve_font({'font': 'ComicNeue'})
+    rng = random.Random(1)
+    for n_words in (1000, 5000, 10000):
+        paragraph = ' '.join(rng.choice(VOCABULARY) for _ in range(n_words))
+        start = time.perf_counter()
+        reference_wrap_text(paragraph, font_name, 18, 450)
+        reference = time.perf_counter() - start
+        start = time.perf_counter()
+        rendering.wrap_text(paragraph, font_name, 18, 450)
+        incremental = time.perf_counter() - start
+        print(f'{n_words:6d} words  original {reference * 1000:7.1f} ms  '
+              f'incremental {incremental * 1000:6.1f} ms  ({reference / incremental:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Opt-in timing spans, counters and latency histograms in the Prometheus text format.
+
+Set METRICS=1 to enable. Disabled (the default), timed() hands back the
+undecorated function and span()/timer() return a shared no-op context
+manager, so instrumented code runs as if it were not instrumented.
+
+Stage spans and counters are also added up per request when a request is
+open in the current thread (begin_request/end_request), for the
+Server-Timing header. Work done in RENDER_PROCESSES/EXPORT_PROCESSES worker
+processes is not collected; only the calling process's timings are.
+"""
+import os
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get('METRICS') == '1'
+PREFIX = 'handwriting_'
+
+# Upper bounds in seconds; everything slower lands in +Inf
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> total
+_histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+_local = threading.local()
+_NOOP = nullcontext()
+
+HELP = {
+    'stage_seconds': 'Time spent in each instrumented rendering/export stage.',
+    'request_seconds': 'Request latency per route.',
+    'render_seconds': 'PDF render latency per page style.',
+    'pages': 'PDF pages rendered.',
+    'glyph_draws': 'Strings and glyphs placed on PDF pages.',
+    'output_bytes': 'Bytes of PDF written.',
+    'cache_hits': 'Deterministic renders served from the result cache.',
+    'cache_misses': 'Deterministic renders that had to be rendered.',
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add value to counter name (and to the open request's counts)."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current['counts'][name] = current['counts'].get(name, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Record one duration in histogram name."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        hist[index] += 1
+        hist[-1] += seconds
+
+
+def _record_stage(stage, seconds):
+    observe('stage_seconds', seconds, stage=stage)
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current['stages'][stage] = current['stages'].get(stage, 0.0) + seconds
+
+
+@contextmanager
+def _timing(record):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(time.perf_counter() - start)
+
+
+def span(stage):
+    """Context manager timing a stage of the current render or export."""
+    if not ENABLED:
+        return _NOOP
+    return _timing(functools.partial(_record_stage, stage))
+
+
+def timer(name, **labels):
+    """Context manager recording its duration in histogram name."""
+    if not ENABLED:
+        return _NOOP
+    return _timing(lambda seconds: observe(name, seconds, **labels))
+
+
+def timed(stage):
+    """Decorator: time every call as a stage span. A no-op unless metrics are enabled."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record_stage(stage, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def begin_request():
+    """Start adding up stages and counts for a request handled by this thread."""
+    if ENABLED:
+        _local.request = {'stages': {}, 'counts': {}}
+
+
+def request_totals():
+    """{'stages': {stage: seconds}, 'counts': {name: total}} of the open request, or None."""
+    return getattr(_local, 'request', None)
+
+
+def end_request():
+    """Close the request opened by begin_request; returns its totals."""
+    current = getattr(_local, 'request', None)
+    _local.request = None
+    return current
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    """Every counter and histogram in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(hist)) for key, hist in _histograms.items())
+    lines = []
+    seen = set()
+    for (name, labels), value in counters:
+        metric = f'{PREFIX}{name}_total'
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f'# HELP {metric} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric}{_format_labels(labels)} {value}')
+    for (name, labels), hist in histograms:
+        metric = f'{PREFIX}{name}'
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f'# HELP {metric} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {metric} histogram')
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), hist):
+            cumulative += n
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{metric}_sum{_format_labels(labels)} {hist[-1]:.6f}')
+        lines.append(f'{metric}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -1,31 +1,89 @@
 """
-Netlify Serverless Function for Flask API
-Note: This is a simplified version. For full Flask functionality, 
-consider using Render.com or Railway.app instead.
+Netlify serverless function for the handwriting API.
+
+Renders with the Flask-independent core in rendering.py and answers
+Lambda-style events (what Netlify functions receive):
+
+  POST /api/generate   same JSON body as the web app's /api/generate;
+                       responds with the PDF itself, base64 encoded
+  GET  /api/fonts      JSON list of font names
+
+Nothing is written to disk: the PDF is rendered into memory. Parsed fonts
+live in module globals, so warm invocations of a container reuse them.
 """
+import base64
 import json
 import os
-from http.server import BaseHTTPRequestHandler
-
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        content_length = int(self.headers.get('Content-Length', 0))
-        post_data = self.rfile.read(content_length)
-        
-        try:
-            data = json.loads(post_data.decode('utf-8'))
-            # Handle API requests here
-            # This is a placeholder - full Flask app needs proper serverless conversion
-            response = {
-                'error': 'Flask app needs to be converted to serverless functions or deployed on Render/Railway'
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+import sys
+from io import BytesIO
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from rendering import available_fonts, generate_pdf, parse_generate_request, seeded_inputs  # noqa: E402
+
+
+def _json(status, payload):
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(payload),
+    }
+
+
+def _route(event):
+    """Last path segment: /api/generate and /.netlify/functions/api/generate both give 'generate'."""
+    path = event.get('path') or event.get('rawPath') or ''
+    return path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def _method(event):
+    return (event.get('httpMethod')
+            or event.get('requestContext', {}).get('http', {}).get('method')
+            or 'GET').upper()
+
+
+def _json_body(event):
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return json.loads(body) if body else None
+
+
+def generate(data):
+    """Render a /api/generate request body; returns the function response."""
+    if not isinstance(data, dict) or not isinstance(data.get('text'), str):
+        return _json(400, {'error': 'No text provided'})
+
+    text, settings = parse_generate_request(data)
+    if settings['deterministic']:
+        # Same seed as the web app's cached renders, so both give identical PDFs
+        text, settings = seeded_inputs(text, settings)
+
+    pdf = generate_pdf(text, settings, BytesIO()).getvalue()
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/pdf',
+            'Content-Disposition': 'attachment; filename="handwritten_assignment.pdf"',
+        },
+        'body': base64.b64encode(pdf).decode('ascii'),
+        'isBase64Encoded': True,
+    }
+
+
+def handler(event, context):
+    route, method = _route(event), _method(event)
+    try:
+        if route == 'fonts' and method == 'GET':
+            return _json(200, list(available_fonts()))
+        if route == 'generate' and method == 'POST':
+            try:
+                data = _json_body(event)
+            except ValueError:
+                return _json(400, {'error': 'Invalid JSON body'})
+            return generate(data)
+        return _json(404, {'error': 'Not found'})
+    except Exception as e:
+        return _json(500, {'error': str(e)})
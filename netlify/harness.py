@@ -0,0 +1,96 @@
+"""
+Local harness for the serverless function: simulates invocations offline.
+
+Loads netlify/functions/api.py in this process the way a fresh container
+would, sends it Lambda-style events, checks every response and reports the
+cold and warm invocation latencies.
+
+Run from the project root:  python netlify/harness.py [--text-file essay.txt] [--runs 5] [--out out.pdf]
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import sys
+import time
+
+FUNCTION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'functions', 'api.py')
+
+SAMPLE_TEXT = """HOME ASSIGNMENT 3
+Name: Jane Doe
+Subject: Physics
+
+Q1. State Newton's second law of motion.
+Ans: The rate of change of momentum of a body is proportional to the applied force.
+Force equals mass times acceleration, so a larger force gives a larger acceleration.
+"""
+
+
+def event(method, path, body=None, base64_body=False):
+    raw = json.dumps(body) if body is not None and not isinstance(body, str) else body
+    if raw is not None and base64_body:
+        raw = base64.b64encode(raw.encode('utf-8')).decode('ascii')
+    return {'httpMethod': method, 'path': path, 'headers': {'content-type': 'application/json'},
+            'body': raw, 'isBase64Encoded': base64_body}
+
+
+def invoke(api, evt):
+    start = time.perf_counter()
+    response = api.handler(evt, None)
+    return response, (time.perf_counter() - start) * 1000
+
+
+def pdf_bytes(response):
+    assert response['statusCode'] == 200, response
+    assert response['isBase64Encoded'] and response['headers']['Content-Type'] == 'application/pdf'
+    pdf = base64.b64decode(response['body'])
+    assert pdf.startswith(b'%PDF-'), pdf[:16]
+    return pdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--text-file', help='render this file instead of the built-in sample')
+    parser.add_argument('--runs', type=int, default=5, help='warm invocations to time')
+    parser.add_argument('--out', help='write the last PDF here')
+    args = parser.parse_args()
+    text = open(args.text_file, encoding='utf-8').read() if args.text_file else SAMPLE_TEXT
+    request = {'text': text, 'font': 'ComicNeue', 'page_style': 'notebook', 'deterministic': True}
+
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('api', FUNCTION)
+    api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api)
+    print(f'import          {(time.perf_counter() - start) * 1000:7.1f} ms')
+
+    response, cold = invoke(api, event('POST', '/.netlify/functions/api/generate', request))
+    first = pdf_bytes(response)
+    print(f'cold generate   {cold:7.1f} ms  ({len(first)} bytes)')
+
+    warm = []
+    for _ in range(args.runs):
+        response, elapsed = invoke(api, event('POST', '/api/generate', request, base64_body=True))
+        assert pdf_bytes(response) == first, 'deterministic renders differ'
+        warm.append(elapsed)
+    print(f'warm generate   {min(warm):7.1f} ms best, {sorted(warm)[len(warm) // 2]:.1f} ms median of {args.runs}')
+
+    response, _ = invoke(api, event('GET', '/api/fonts'))
+    assert response['statusCode'] == 200 and 'ComicNeue' in json.loads(response['body'])
+    for evt, status in ((event('POST', '/api/generate', '{not json'), 400),
+                        (event('POST', '/api/generate', {'font': 'ComicNeue'}), 400),
+                        (event('GET', '/api/generate'), 404),
+                        (event('GET', '/api/nothing'), 404)):
+        response, _ = invoke(api, evt)
+        assert response['statusCode'] == status, (evt, response)
+    print('fonts, bad JSON, missing text and unknown routes answered as expected')
+
+    if args.out:
+        with open(args.out, 'wb') as f:
+            f.write(pdf_bytes(response := invoke(api, event('POST', '/api/generate', request))[0]))
+        print(f'wrote {args.out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+Direct raster backend: draws laid-out pages straight onto Pillow images, no PDF step.
+
+RasterCanvas implements the part of the ReportLab canvas and text object API
+that page_background_form, DocumentLayout.replay, draw_text_run and
+draw_header_footer use. Image output therefore goes through the same layout
+and the same random draws as generate_pdf, and every glyph lands where it
+would in the PDF. Text is composited from GlyphAtlas masks: each glyph of a
+font is rendered once per pixel size with Pillow's ImageFont and reused for
+every later occurrence.
+"""
+import math
+import os
+import random
+import threading
+from collections import OrderedDict
+
+import metrics
+from rendering import (A4, PAGE_SIZES, available_fonts, draw_header_footer, glyph_widths,
+                       layout_document, page_background_form)
+
+# Glyph sizes are rounded to this many pixels, so the realism renderers'
+# continuous size variation maps onto a handful of atlases per font.
+ATLAS_SIZE_STEP = 0.5
+ATLAS_CACHE_SIZE = 64
+
+# Type 1 files ReportLab bundles for the standard PDF fonts a canvas can fall back to
+STANDARD_FONT_FILES = {'Helvetica': '_a______.pfb'}
+
+_atlases = OrderedDict()
+_atlas_lock = threading.Lock()
+
+
+def _font_path(font_name):
+    """Font file for font_name: an available font, or ReportLab's copy of a standard font."""
+    path = available_fonts().get(font_name)
+    if path is None and font_name in STANDARD_FONT_FILES:
+        import reportlab
+        path = os.path.join(os.path.dirname(reportlab.__file__), 'fonts', STANDARD_FONT_FILES[font_name])
+    return path
+
+
+class GlyphAtlas:
+    """Coverage masks for one font at one pixel size, each rendered the first time it is drawn.
+
+    glyph(ch) is (mask, left, top): an 'L' image and its offset from the
+    baseline origin, or None for glyphs that leave no ink (spaces).
+    """
+
+    def __init__(self, font_name, px_size):
+        from PIL import ImageFont
+        path = _font_path(font_name)
+        self.font = ImageFont.truetype(path, px_size) if path else ImageFont.load_default(px_size)
+        self.glyphs = {}
+
+    def glyph(self, ch):
+        try:
+            return self.glyphs[ch]
+        except KeyError:
+            pass
+        from PIL import Image, ImageDraw
+        left, top, right, bottom = self.font.getbbox(ch, anchor='ls')
+        glyph = None
+        if right > left and bottom > top:
+            mask = Image.new('L', (right - left, bottom - top))
+            ImageDraw.Draw(mask).text((-left, -top), ch, font=self.font, fill=255, anchor='ls')
+            glyph = (mask, left, top)
+        self.glyphs[ch] = glyph
+        return glyph
+
+
+def glyph_atlas(font_name, px_size):
+    """The shared atlas for font_name at px_size (rounded to ATLAS_SIZE_STEP)."""
+    px_size = max(ATLAS_SIZE_STEP, round(px_size / ATLAS_SIZE_STEP) * ATLAS_SIZE_STEP)
+    key = (font_name, px_size)
+    with _atlas_lock:
+        atlas = _atlases.get(key)
+        if atlas is None:
+            atlas = _atlases[key] = GlyphAtlas(font_name, px_size)
+            while len(_atlases) > ATLAS_CACHE_SIZE:
+                _atlases.popitem(last=False)
+        else:
+            _atlases.move_to_end(key)
+        return atlas
+
+
+def _rgb(color):
+    return tuple(round(255 * v) for v in (color.red, color.green, color.blue))
+
+
+class RasterText:
+    """Text object for RasterCanvas.beginText, with the methods draw_text_run uses.
+
+    Like a PDF text object, moveCursor moves relative to the start of the
+    current line, font changes stay inside the object, and fill colors carry
+    over to the canvas.
+    """
+
+    def __init__(self, canvas, x, y):
+        self._canvas = canvas
+        self._line_x, self._y = x, y
+        self._x = x
+        self._rise = 0
+        self._font_name, self._font_size = canvas._font_name, canvas._font_size
+        self._ops = []
+
+    def moveCursor(self, dx, dy):
+        self._line_x += dx
+        self._y -= dy
+        self._x = self._line_x
+
+    def setRise(self, rise):
+        self._rise = rise
+
+    def setFont(self, font_name, size):
+        self._font_name, self._font_size = font_name, size
+
+    def setFillColorRGB(self, r, g, b):
+        self._ops.append(('fill', (round(255 * r), round(255 * g), round(255 * b))))
+
+    def textOut(self, text):
+        self._ops.append(('text', text, self._x, self._y + self._rise, self._font_name, self._font_size))
+        self._x += sum(glyph_widths(text, self._font_name, self._font_size))
+
+
+class RasterCanvas:
+    """Draws ReportLab canvas calls onto an RGB page image at dpi.
+
+    Covers what the page backgrounds, layout replay and header/footer need:
+    fills, strokes, lines, rects, circles, strings, text objects, images,
+    forms, and a rotation for the watermark. Strokes thinner than a pixel are
+    drawn one pixel wide in a proportionally lighter color, an approximation
+    of the antialiased hairline a PDF viewer shows.
+    """
+
+    def __init__(self, width, height, dpi=200):
+        self.width, self.height = width, height
+        self.scale = dpi / 72
+        # Rounded up like PyMuPDF's pixmaps (less its 0.001 px tolerance), so
+        # pages match /api/export's at every dpi
+        self.size = (math.ceil(width * self.scale - 0.001), math.ceil(height * self.scale - 0.001))
+        self.forms = {}
+        self.image = self._draw = None
+        self._form_target = None
+        self._reset_state()
+
+    def _reset_state(self):
+        # ReportLab's initial graphics state, which showPage also goes back to
+        self._fill = self._stroke = (0, 0, 0)
+        self._line_width = 1
+        self._font_name, self._font_size = 'Helvetica', 12
+        self._angle = 0
+        self._states = []
+
+    def begin_page(self, background=None):
+        """Start a new page image, optionally a copy of a form drawn earlier.
+
+        Like showPage, this resets fill, stroke, line width and font.
+        """
+        from PIL import Image, ImageDraw
+        self._reset_state()
+        if background is not None:
+            self.image = self.forms[background].copy()
+        else:
+            self.image = Image.new('RGB', self.size, (255, 255, 255))
+        self._draw = ImageDraw.Draw(self.image)
+
+    def _xy(self, x, y):
+        if self._angle:
+            cos, sin = math.cos(self._angle), math.sin(self._angle)
+            x, y = x * cos - y * sin, x * sin + y * cos
+        return x * self.scale, (self.height - y) * self.scale
+
+    # Graphics state
+
+    def setFillColor(self, color):
+        self._fill = _rgb(color)
+
+    def setStrokeColor(self, color):
+        self._stroke = _rgb(color)
+
+    def setLineWidth(self, width):
+        self._line_width = width
+
+    def setFont(self, font_name, size):
+        self._font_name, self._font_size = font_name, size
+
+    def saveState(self):
+        self._states.append((self._fill, self._stroke, self._line_width, self._font_name, self._font_size, self._angle))
+
+    def restoreState(self):
+        self._fill, self._stroke, self._line_width, self._font_name, self._font_size, self._angle = self._states.pop()
+
+    def rotate(self, degrees):
+        self._angle += math.radians(degrees)
+
+    # Forms
+
+    def beginForm(self, name):
+        self._form_target = (name, self.image, self._draw)
+        self.begin_page()
+
+    def endForm(self):
+        name, image, draw = self._form_target
+        self.forms[name] = self.image
+        self.image, self._draw = image, draw
+        self._form_target = None
+
+    # Shapes
+
+    def _stroke_style(self):
+        width = self._line_width * self.scale
+        if width >= 1:
+            return self._stroke, round(width)
+        white = 255 * (1 - width)
+        return tuple(round(c * width + white) for c in self._stroke), 1
+
+    def line(self, x1, y1, x2, y2):
+        color, width = self._stroke_style()
+        self._draw.line([self._xy(x1, y1), self._xy(x2, y2)], fill=color, width=width)
+
+    def rect(self, x, y, width, height, fill=0, stroke=1):
+        (x1, y1), (x2, y2) = self._xy(x, y), self._xy(x + width, y + height)
+        color, line_width = self._stroke_style()
+        self._draw.rectangle([min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)],
+                             fill=self._fill if fill else None, outline=color if stroke else None,
+                             width=line_width)
+
+    def circle(self, x, y, r, fill=0, stroke=1):
+        cx, cy = self._xy(x, y)
+        r *= self.scale
+        color, line_width = self._stroke_style()
+        self._draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=self._fill if fill else None,
+                           outline=color if stroke else None, width=line_width)
+
+    def drawImage(self, image, x, y, width=None, height=None):
+        from PIL import Image
+        img = getattr(image, '_image', image)  # ReportLab ImageReader or a PIL image
+        size = (round((width or img.width) * self.scale), round((height or img.height) * self.scale))
+        img = img.convert('RGBA').resize(size, Image.Resampling.LANCZOS)
+        left, bottom = self._xy(x, y)
+        self.image.paste(img, (round(left), round(bottom) - size[1]), img)
+
+    # Text
+
+    def _glyphs(self, text, x, y, font_name, size, fill):
+        """Composite text with its baseline origin at user-space (x, y), unrotated."""
+        atlas = glyph_atlas(font_name, size * self.scale)
+        px, py = self._xy(x, y)
+        paste = self.image.paste
+        for ch, advance in zip(text, glyph_widths(text, font_name, size)):
+            glyph = atlas.glyph(ch)
+            if glyph is not None:
+                mask, left, top = glyph
+                paste(fill, (round(px) + left, round(py) + top), mask)
+            px += advance * self.scale
+
+    def _rotated_glyphs(self, text, x, y, font_name, size, fill):
+        """Text on a rotated coordinate system: draw it on its own mask, rotate that, composite it."""
+        from PIL import Image
+        atlas = glyph_atlas(font_name, size * self.scale)
+        advances = [w * self.scale for w in glyph_widths(text, font_name, size)]
+        ascent, descent = atlas.font.getmetrics()
+        mask = Image.new('L', (math.ceil(sum(advances)) + ascent, ascent + descent))
+        pen = 0.0
+        for ch, advance in zip(text, advances):
+            glyph = atlas.glyph(ch)
+            if glyph is not None:
+                glyph_mask, left, top = glyph
+                mask.paste(255, (round(pen) + left, ascent + top), glyph_mask)
+            pen += advance
+        degrees = math.degrees(self._angle)
+        rotated = mask.rotate(degrees, expand=True, resample=Image.Resampling.BICUBIC)
+        # Where the baseline origin (0, ascent) of the mask ends up after the rotation
+        vx, vy = -mask.width / 2, ascent - mask.height / 2
+        cos, sin = math.cos(self._angle), math.sin(self._angle)
+        ox = rotated.width / 2 + vx * cos + vy * sin
+        oy = rotated.height / 2 - vx * sin + vy * cos
+        px, py = self._xy(x, y)
+        self.image.paste(fill, (round(px - ox), round(py - oy)), rotated)
+
+    def drawString(self, x, y, text):
+        draw = self._rotated_glyphs if self._angle else self._glyphs
+        draw(text, x, y, self._font_name, self._font_size, self._fill)
+
+    def beginText(self, x=0, y=0):
+        return RasterText(self, x, y)
+
+    def drawText(self, text_object):
+        for op, *args in text_object._ops:
+            if op == 'fill':
+                self._fill = args[0]
+            else:
+                text, x, y, font_name, size = args
+                self._glyphs(text, x, y, font_name, size, self._fill)
+
+
+class RasterDocument:
+    """A document laid out like generate_pdf does, whose pages are drawn to images on demand.
+
+    Uses the same seed handling and random draws as generate_pdf, so page
+    N's image matches page N of the PDF rendered from the same settings.
+    """
+
+    def __init__(self, text, settings, dpi=200):
+        width, height = PAGE_SIZES.get(settings.get('page_size', 'A4'), A4)
+        rng = random.Random(settings.get('seed'))
+        self.settings = settings
+        self.canvas = RasterCanvas(width, height, dpi)
+        self.background = page_background_form(self.canvas, width, height, settings, rng)
+        self.layout = layout_document(text, settings, rng)
+
+    def __len__(self):
+        return len(self.layout.pages)
+
+    @metrics.timed('raster_page')
+    def page_image(self, index):
+        """RGB image of page index (0-based)."""
+        c = self.canvas
+        c.begin_page(self.background)
+        draw_header_footer(c, self.layout, self.settings, index + 1, len(self))
+        self.layout.replay(c, index)
+        return c.image
@@ -0,0 +1,1136 @@
+"""
+Handwriting rendering core: fonts, line classification, layout and PDF drawing.
+
+Independent of Flask so it can back both the web app (app.py) and the
+serverless handler (netlify/functions/api.py). ReportLab and Pillow are
+imported by the functions that need them, so importing this module is cheap.
+"""
+import os
+import re
+import html
+import codecs
+import json
+import uuid
+import random
+import hashlib
+import threading
+from array import array
+from io import BytesIO
+
+from reportlab.lib.pagesizes import A4, LETTER, LEGAL
+from reportlab.lib.units import mm
+
+import metrics
+
+FONTS_DIR = os.path.join(os.path.dirname(__file__), 'fonts')
+# Prefer project dir; on read-only FS (e.g. Vercel) use temp dir. Created by
+# ensure_generated_dir() before the first write, not at import.
+GENERATED_DIR = os.path.join(os.path.dirname(__file__), 'generated')
+if not os.access(GENERATED_DIR if os.path.isdir(GENERATED_DIR) else os.path.dirname(GENERATED_DIR), os.W_OK):
+    import tempfile
+    GENERATED_DIR = os.path.join(tempfile.gettempdir(), 'handwriting_generated')
+_generated_dir_ready = False
+
+def ensure_generated_dir():
+    """Create GENERATED_DIR if this process hasn't yet."""
+    global _generated_dir_ready
+    if not _generated_dir_ready:
+        os.makedirs(GENERATED_DIR, exist_ok=True)
+        _generated_dir_ready = True
+
+# Font display name -> TTF path, read from the font index below the first time
+# available_fonts() is called. Fonts are only parsed and registered with
+# ReportLab when first used (load_font), so a worker that renders in one font
+# never holds the other 37 in memory.
+AVAILABLE_FONTS = {}
+_fonts_indexed = False
+# (name, mtime, size) per TTF in FONTS_DIR, cached between starts so building
+# AVAILABLE_FONTS is a directory listing rather than parsing every font.
+FONT_INDEX = os.path.join(GENERATED_DIR, 'fonts.json')
+# Advance widths (1/1000 em) per codepoint for each registered TTF, taken from
+# the font's hmtx data so measuring text is a table lookup instead of a
+# ReportLab stringWidth call.
+FONT_WIDTH_TABLES = {}
+WIDTH_TABLE_SIZE = 0x800
+_font_lock = threading.Lock()
+
+def build_width_table(font):
+    """Dense advance-width table for the first WIDTH_TABLE_SIZE codepoints of a TTFont."""
+    char_widths = font.face.charWidths
+    default = font.face.defaultWidth
+    return array('d', [char_widths.get(cp, default) for cp in range(WIDTH_TABLE_SIZE)])
+
+def _read_font_index():
+    try:
+        with open(FONT_INDEX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def register_fonts():
+    """Build AVAILABLE_FONTS from FONTS_DIR, parsing only fonts the index hasn't seen."""
+    if not os.path.isdir(FONTS_DIR):
+        os.makedirs(FONTS_DIR, exist_ok=True)
+        return
+    cached = _read_font_index()
+    index = {}
+    for filename in sorted(os.listdir(FONTS_DIR)):
+        if not filename.endswith('.ttf'):
+            continue
+        path = os.path.join(FONTS_DIR, filename)
+        st = os.stat(path)
+        entry = cached.get(filename)
+        if not entry or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            name = os.path.splitext(filename)[0]
+            display_name = name.replace('-Regular', '').replace('QE', '')
+            from reportlab.pdfbase.ttfonts import TTFont
+            try:
+                TTFont(display_name, path)
+                valid = True
+            except Exception:
+                valid = False
+            entry = {'name': display_name, 'mtime': st.st_mtime, 'size': st.st_size, 'valid': valid}
+        index[filename] = entry
+        if entry['valid']:
+            AVAILABLE_FONTS[entry['name']] = path
+    if index != cached:
+        tmp = f'{FONT_INDEX}.{os.getpid()}.tmp'
+        try:
+            ensure_generated_dir()
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, FONT_INDEX)
+        except OSError:
+            pass
+
+def available_fonts():
+    """AVAILABLE_FONTS, reading the font index the first time it is needed."""
+    global _fonts_indexed
+    if not _fonts_indexed:
+        with _font_lock:
+            if not _fonts_indexed:
+                register_fonts()
+                _fonts_indexed = True
+    return AVAILABLE_FONTS
+
+def load_font(font_name):
+    """Register an available font with ReportLab on first use; returns its width table."""
+    table = FONT_WIDTH_TABLES.get(font_name)
+    if table is not None:
+        return table
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    with _font_lock:
+        if font_name not in FONT_WIDTH_TABLES:
+            font = TTFont(font_name, AVAILABLE_FONTS[font_name])
+            pdfmetrics.registerFont(font)
+            FONT_WIDTH_TABLES[font_name] = build_width_table(font)
+    return FONT_WIDTH_TABLES[font_name]
+
+def preload_fonts():
+    """Load every available font now, e.g. in a server master before it forks workers."""
+    for font_name in available_fonts():
+        load_font(font_name)
+
+def _glyph_units(text, font_name, table):
+    """Per-character advance widths in 1/1000 em, falling back to the font's cmap past the table."""
+    from reportlab.pdfbase import pdfmetrics
+    face = pdfmetrics.getFont(font_name).face
+    char_widths, default = face.charWidths, face.defaultWidth
+    return [table[cp] if cp < WIDTH_TABLE_SIZE else char_widths.get(cp, default)
+            for cp in map(ord, text)]
+
+def text_units(text, font_name):
+    """Width of text in 1/1000 em, summed from the font's precomputed advance table."""
+    table = FONT_WIDTH_TABLES.get(font_name)
+    if table is None:
+        if font_name not in available_fonts():
+            from reportlab.pdfbase import pdfmetrics
+            return pdfmetrics.stringWidth(text, font_name, 1000)
+        table = load_font(font_name)
+    try:
+        return sum(map(table.__getitem__, map(ord, text)))
+    except IndexError:
+        return sum(_glyph_units(text, font_name, table))
+
+def text_width(text, font_name, font_size):
+    """Width of text in points."""
+    return 0.001 * font_size * text_units(text, font_name)
+
+def glyph_widths(text, font_name, font_size):
+    """List of per-character widths in points, for renderers that place glyphs one by one."""
+    table = FONT_WIDTH_TABLES.get(font_name)
+    if table is None:
+        if font_name not in available_fonts():
+            from reportlab.pdfbase import pdfmetrics
+            return [pdfmetrics.stringWidth(ch, font_name, font_size) for ch in text]
+        table = load_font(font_name)
+    scale = 0.001 * font_size
+    try:
+        return [table[cp] * scale for cp in map(ord, text)]
+    except IndexError:
+        return [u * scale for u in _glyph_units(text, font_name, table)]
+
+PAGE_SIZES = {
+    'A4': A4,
+    'A3': (297*mm, 420*mm),
+    'A5': (148*mm, 210*mm),
+    'Letter': LETTER,
+    'Legal': LEGAL,
+}
+
+# Styles draw_page_background knows; parse_settings turns anything else into
+# 'blank', which is how it would have been drawn anyway.
+PAGE_STYLES = ('blank', 'cream', 'aged', 'recycled', 'parchment', 'legal_yellow', 'notebook', 'grid',
+               'grain', 'fold_crease', 'corner_shadow')
+
+def sanitize_text(text):
+    text = html.escape(text)
+    text = text.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>').replace('&#x27;', "'").replace('&quot;', '"')
+    return text
+
+# Structural line kinds, tried in order against the start of a stripped line
+# as one compiled alternation; the matching group's name is the kind. 'field'
+# is a bare STUDENT:/ROLL: label that auto_structure keeps on its own line but
+# classify_line renders as ordinary answer text.
+LINE_RULES = [
+    ('name', r'(?:NAME|STUDENT NAME)\s*[:.]'),
+    ('id', r'(?:ID|ROLL NO|STUDENT ID|REG)\s*[:.]'),
+    ('date', r'(?:DATE|SUBMITTED ON)\s*[:.]'),
+    ('subject', r'(?:SUBJECT|COURSE|CLASS)\s*[:.]'),
+    ('question', r'\d+[.)]\s+|Q\d+|Question\s+\d+'),
+    ('answer_label', r'(?:Ans|Answer|A)\s*[:.)]'),
+    ('heading', r'\#'),
+    ('field', r'(?:STUDENT|ROLL)\s*[:.]'),
+]
+LINE_PATTERN = re.compile('|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in LINE_RULES), re.IGNORECASE)
+TITLE_KEYWORDS = ('ASSIGNMENT', 'HOMEWORK')
+
+def line_kind(stripped):
+    """Kind of a non-empty stripped line: 'title', a LINE_RULES kind, or 'answer'."""
+    upper = stripped.upper()
+    if any(kw in upper for kw in TITLE_KEYWORDS):
+        return 'title'
+    m = LINE_PATTERN.match(stripped)
+    return m.lastgroup if m else 'answer'
+
+def classify_line(line):
+    stripped = line.strip()
+    if not stripped:
+        return 'empty', stripped
+    kind = line_kind(stripped)
+    if kind == 'heading':
+        return 'heading', stripped.lstrip('#').strip()
+    if kind == 'field':
+        return 'answer', stripped
+    return kind, stripped
+
+@metrics.timed('draw_page_background')
+def draw_page_background(c, width, height, settings, rng=random):
+    from reportlab.lib.colors import HexColor
+    page_style = settings.get('page_style', 'blank')
+    margin_left = settings.get('margin_left', 60)
+
+    if page_style == 'cream':
+        c.setFillColor(HexColor('#FFF8E7'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+    elif page_style == 'aged':
+        c.setFillColor(HexColor('#F5E6C8'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setFillColor(HexColor('#EAD5AA'))
+        for _ in range(25):
+            x = rng.uniform(0, width)
+            y = rng.uniform(0, height)
+            r = rng.uniform(1, 5)
+            c.circle(x, y, r, fill=1, stroke=0)
+    elif page_style == 'recycled':
+        c.setFillColor(HexColor('#DCD6CB'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setStrokeColor(HexColor('#C4BBAF'))
+        for _ in range(100):
+            x = rng.uniform(0, width)
+            y = rng.uniform(0, height)
+            c.line(x, y, x + rng.uniform(1, 3), y + rng.uniform(1, 3))
+    elif page_style == 'parchment':
+        c.setFillColor(HexColor('#FCF5E5'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setStrokeColor(HexColor('#F0E4C8'))
+        c.setLineWidth(0.5)
+        for _ in range(30):
+            x = rng.uniform(0, width)
+            y = rng.uniform(0, height)
+            c.circle(x, y, rng.uniform(10, 30), fill=0, stroke=1)
+    elif page_style == 'legal_yellow':
+        c.setFillColor(HexColor('#FFF9C4'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setStrokeColor(HexColor('#E0E0E0'))
+        c.setLineWidth(0.3)
+        line_spacing = settings.get('line_spacing', 28)
+        y = height - 60
+        while y > 40:
+            c.line(margin_left, y, width - 30, y)
+            y -= line_spacing
+        c.setStrokeColor(HexColor('#FF9999'))
+        c.setLineWidth(0.8)
+        c.line(margin_left, height, margin_left, 0)
+    elif page_style == 'notebook':
+        c.setFillColor(HexColor('#FFFFFF'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setStrokeColor(HexColor('#E0E0E0'))
+        c.setLineWidth(0.3)
+        line_spacing = settings.get('line_spacing', 28)
+        y = height - 60
+        while y > 40:
+            c.line(margin_left, y, width - 30, y)
+            y -= line_spacing
+        c.setStrokeColor(HexColor('#FF9999'))
+        c.setLineWidth(0.8)
+        c.line(margin_left, height, margin_left, 0)
+    elif page_style == 'grid':
+        c.setFillColor(HexColor('#FFFFFF'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setStrokeColor(HexColor('#E8E8E8'))
+        c.setLineWidth(0.2)
+        step = 20
+        x = 0
+        while x <= width:
+            c.line(x, 0, x, height)
+            x += step
+        y = 0
+        while y <= height:
+            c.line(0, y, width, y)
+            y += step
+    elif page_style == 'grain':
+        c.setFillColor(HexColor('#FDFBF7'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setFillColor(HexColor('#E8E4DC'))
+        for _ in range(400):
+            x = rng.uniform(0, width)
+            y = rng.uniform(0, height)
+            r = rng.uniform(0.3, 1)
+            c.circle(x, y, r, fill=1, stroke=0)
+    elif page_style == 'fold_crease':
+        c.setFillColor(HexColor('#FFFFFF'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.setStrokeColor(HexColor('#E8E8E8'))
+        c.setLineWidth(0.5)
+        crease_y = height * 0.35 + rng.uniform(-20, 20)
+        c.line(0, crease_y, width, crease_y + rng.uniform(-3, 3))
+    elif page_style == 'corner_shadow':
+        c.setFillColor(HexColor('#FFFFFF'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        for (cx, cy) in [(0, 0), (width, 0), (0, height), (width, height)]:
+            c.setFillColor(HexColor('#F0F0F0'))
+            c.circle(cx, cy, 80, fill=1, stroke=0)
+    else:
+        c.setFillColor(HexColor('#FFFFFF'))
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+
+def draw_margin_rules(c, width, height, settings):
+    """Red margin rule (and optional second rule) down the left side of the page."""
+    from reportlab.lib.colors import HexColor
+    if not settings.get('margin_rule', True):
+        return
+    margin_left = settings.get('margin_left', 60)
+    c.setStrokeColor(HexColor('#FF9999'))
+    c.setLineWidth(0.8)
+    # Ruled styles already draw the first margin line as part of the background
+    if settings.get('page_style', 'blank') not in ('legal_yellow', 'notebook'):
+        c.line(margin_left, height, margin_left, 0)
+    if settings.get('double_margin', False):
+        c.line(margin_left + 12, height, margin_left + 12, 0)
+
+def page_background_form(c, width, height, settings, rng=random):
+    """Draw the page background and margin rules once as a Form XObject.
+
+    Every page then references the form with doForm instead of redrawing it.
+    With a background_seed setting the random texture is reproducible, so the
+    same background comes out in every document that uses that seed.
+    """
+    seed = settings.get('background_seed')
+    if seed is not None:
+        rng = random.Random(seed)
+    name = 'PageBackground'
+    c.beginForm(name)
+    draw_page_background(c, width, height, settings, rng)
+    draw_margin_rules(c, width, height, settings)
+    c.endForm()
+    return name
+
+def apply_realism(value, variation, enabled, rng=random):
+    if not enabled:
+        return value
+    return value + rng.uniform(-variation, variation)
+
+class DocumentLayout:
+    """Pages of drawing operations produced by layout_document.
+
+    Records the canvas calls the renderer makes (setFont, drawString, line,
+    ...) per page instead of drawing them, so a document is fully paginated
+    before anything is drawn and can be replayed onto any canvas.
+    """
+
+    def __init__(self, width, height, font_name, font_size):
+        self.width = width
+        self.height = height
+        self.font_name = font_name
+        self.font_size = font_size
+        self.pages = [[]]
+
+    @classmethod
+    def from_settings(cls, settings):
+        width, height = PAGE_SIZES.get(settings.get('page_size', 'A4'), A4)
+        return cls(width, height, resolve_font(settings), settings.get('font_size', 18))
+
+    def new_page(self):
+        self.pages.append([])
+
+    def setFont(self, name, size):
+        self.pages[-1].append(('setFont', name, size))
+
+    def setFillColor(self, color):
+        self.pages[-1].append(('setFillColor', color))
+
+    def setStrokeColor(self, color):
+        self.pages[-1].append(('setStrokeColor', color))
+
+    def setLineWidth(self, width):
+        self.pages[-1].append(('setLineWidth', width))
+
+    def drawString(self, x, y, text):
+        self.pages[-1].append(('drawString', x, y, text))
+
+    def line(self, x1, y1, x2, y2):
+        self.pages[-1].append(('line', x1, y1, x2, y2))
+
+    def drawImage(self, image, x, y, width=None, height=None):
+        self.pages[-1].append(('drawImage', image, x, y, width, height))
+
+    def drawTextRun(self, font_name, glyphs):
+        self.pages[-1].append(('drawTextRun', font_name, glyphs))
+
+    def replay(self, c, page_index):
+        """Draw one recorded page onto canvas c."""
+        replay_page(c, self.pages[page_index])
+
+def replay_page(c, ops):
+    """Draw a page's recorded operations onto canvas c."""
+    for op, *args in ops:
+        if op == 'drawTextRun':
+            draw_text_run(c, *args)
+        else:
+            getattr(c, op)(*args)
+
+def draw_text_run(c, font_name, glyphs):
+    """Draw a run of placed text as one PDF text object.
+
+    glyphs are (x, baseline, rise, text, size, color) tuples. Each placement
+    is a Td move from the previous one, jitter off the baseline is text rise,
+    and size/color are only emitted when they change (None keeps the
+    canvas's current font or fill color). Positions are rounded to 1/100 pt
+    and colors to 1/1000, far below what a viewer can show, to keep the
+    content stream short.
+    """
+    x0, y0 = round(glyphs[0][0], 2), round(glyphs[0][1], 2)
+    t = c.beginText(x0, y0)
+    rise = 0
+    size = color = None
+    for x, y, glyph_rise, text, glyph_size, glyph_color in glyphs:
+        x, y = round(x, 2), round(y, 2)
+        if x != x0 or y != y0:
+            t.moveCursor(x - x0, y0 - y)
+            x0, y0 = x, y
+        glyph_rise = round(glyph_rise, 2)
+        if glyph_rise != rise:
+            t.setRise(glyph_rise)
+            rise = glyph_rise
+        if glyph_color is not None and glyph_color is not color:
+            t.setFillColorRGB(round(glyph_color.red, 3), round(glyph_color.green, 3), round(glyph_color.blue, 3))
+            color = glyph_color
+        if glyph_size is not None and round(glyph_size, 2) != size:
+            size = round(glyph_size, 2)
+            t.setFont(font_name, size)
+        t.textOut(text)
+    if rise:
+        # Text rise outlives ET; later drawString calls expect none
+        t.setRise(0)
+    c.drawText(t)
+
+def resolve_font(settings):
+    """The registered font to render with, falling back to the first available."""
+    fonts = available_fonts()
+    font_name = settings.get('font', 'ComicNeue')
+    if font_name not in fonts:
+        if not fonts:
+            return 'Helvetica'
+        font_name = next(iter(fonts))
+    load_font(font_name)
+    return font_name
+
+def draw_header_footer(c, layout, settings, page_num, total_pages=None):
+    """Draw header, footer, page numbers, and watermark."""
+    from reportlab.lib.colors import HexColor
+    font_name, font_size = layout.font_name, layout.font_size
+    width, height = layout.width, layout.height
+    header_text = settings.get('header_text', '')
+    footer_text = settings.get('footer_text', '')
+    watermark_text = settings.get('watermark_text', '')
+
+    # Header
+    if header_text:
+        c.setFont(font_name, font_size - 2)
+        c.setFillColor(HexColor('#666666'))
+        header_y = height - 25
+        tw = text_width(header_text, font_name, font_size - 2)
+        c.drawString((width - tw) / 2, header_y, header_text)
+
+    # Footer
+    footer_y = 20
+    footer_items = []
+    if footer_text:
+        footer_items.append(footer_text)
+    if settings.get('page_numbers', False):
+        page_str = f"Page {page_num}"
+        if total_pages:
+            page_str += f" of {total_pages}"
+        footer_items.append(page_str)
+
+    if footer_items:
+        footer_line = " • ".join(footer_items)
+        c.setFont(font_name, font_size - 3)
+        c.setFillColor(HexColor('#666666'))
+        tw = text_width(footer_line, font_name, font_size - 3)
+        c.drawString((width - tw) / 2, footer_y, footer_line)
+
+    # Watermark
+    if watermark_text:
+        c.saveState()
+        c.setFont(font_name, font_size + 10)
+        c.setFillColor(HexColor('#E0E0E0'))
+        c.rotate(45)
+        tw = text_width(watermark_text, font_name, font_size + 10)
+        c.drawString(width / 2 - tw / 2, height / 2, watermark_text)
+        c.restoreState()
+
+def layout_document(text, settings, rng=None):
+    """Lay text out into pages without drawing it; returns a DocumentLayout."""
+    layout = DocumentLayout.from_settings(settings)
+    layout.pages = list(iter_pages(layout, text.split('\n'), settings, rng))
+    return layout
+
+def iter_pages(layout, lines, settings, rng=None):
+    """Lay lines out onto layout, yielding each page's operations once the page is full.
+
+    lines may be any iterable, consumed lazily, and finished pages are handed
+    over rather than kept, so only the page being filled is held in memory.
+    Random draws come from rng, the render's random.Random; by default a new
+    one seeded from settings['seed'].
+    """
+    from reportlab.lib.colors import HexColor
+    if rng is None:
+        rng = random.Random(settings.get('seed'))
+    width, height = layout.width, layout.height
+    font_name = layout.font_name
+
+    font_size = layout.font_size
+    line_spacing = settings.get('line_spacing', 28)
+    margin_left = settings.get('margin_left', 60)
+    margin_right = max(40, settings.get('margin_right', 40))
+    margin_top = 50
+    margin_bottom = 50
+
+    spacing_variation = settings.get('spacing_variation', True)
+    jitter = settings.get('jitter', True)
+    ink_variation = settings.get('ink_variation', True)
+    word_size_variation = settings.get('word_size_variation', True)
+    baseline_shift = settings.get('baseline_shift', True)
+    jitter_strength = settings.get('jitter_strength', 1.0)
+    ink_flow = settings.get('ink_flow', True)
+    ink = InkPalette(settings.get('ink_color', '#0A1F5C'), ink_flow, settings.get('gel_pen', False), rng)
+    new_question_on_new_page = settings.get('new_question_on_new_page', False)
+    margin_rule = settings.get('margin_rule', True)
+    double_margin = settings.get('double_margin', False)
+    bold_question = settings.get('bold_question', False)
+    underline_headings = settings.get('underline_headings', False)
+    signature_data = settings.get('signature_base64')
+
+    def new_page():
+        """Start the next page; returns the top y."""
+        layout.new_page()
+        return height - margin_top
+
+    y = height - margin_top
+    x_base = margin_left + 10
+    if margin_rule:
+        x_base = margin_left + 16 if double_margin else margin_left + 10
+
+    usable_width = width - margin_left - margin_right - 20
+    if margin_rule:
+        usable_width -= 4
+    if double_margin:
+        usable_width -= 4
+
+    for line in lines:
+        while len(layout.pages) > 1:
+            yield layout.pages.pop(0)
+        line_type, content = classify_line(line)
+
+        if line_type == 'empty':
+            y -= line_spacing * 0.6
+            if y < margin_bottom:
+                y = new_page()
+            continue
+
+        if line_type == 'question' and new_question_on_new_page and y < height - margin_top - 50:
+            y = new_page()
+
+        if line_type == 'title':
+            layout.setFont(font_name, font_size + 6)
+            layout.setFillColor(HexColor('#000000'))
+            tw = text_width(content, font_name, font_size + 6)
+            x = (width - tw) / 2
+            jitter_y = apply_realism(0, 1.5, jitter, rng)
+            layout.drawString(x, y + jitter_y, content)
+            if underline_headings:
+                layout.setStrokeColor(HexColor('#000000'))
+                layout.setLineWidth(0.5)
+                layout.line(x, y - 2, x + tw, y - 2)
+            y -= line_spacing * 1.8
+        elif line_type in ('name', 'id', 'subject'):
+            layout.setFont(font_name, font_size + 1)
+            layout.setFillColor(HexColor('#000000'))
+            jitter_x = apply_realism(0, 1, jitter, rng)
+            jitter_y = apply_realism(0, 1, jitter, rng)
+            layout.drawString(x_base + jitter_x, y + jitter_y, content)
+            y -= line_spacing * 1.3
+        elif line_type == 'date':
+            layout.setFont(font_name, font_size + 1)
+            layout.setFillColor(HexColor('#000000'))
+            tw = text_width(content, font_name, font_size + 1)
+            x = width - margin_right - tw - 10
+            jitter_y = apply_realism(0, 1, jitter, rng)
+            layout.drawString(x, y + jitter_y, content)
+            y -= line_spacing * 1.3
+        elif line_type == 'question':
+            qfs = font_size + 1
+            layout.setFont(font_name, qfs)
+            layout.setFillColor(HexColor('#000000'))
+            wrapped = wrap_text(content, font_name, qfs, usable_width)
+            for wl in wrapped:
+                if y < margin_bottom:
+                    y = new_page()
+                    yield layout.pages.pop(0)
+                jitter_x = apply_realism(0, 1.2, jitter, rng)
+                jitter_y = apply_realism(0, 1, jitter, rng)
+                if bold_question:
+                    layout.drawString(x_base + jitter_x + 0.4, y + jitter_y, wl)
+                layout.drawString(x_base + jitter_x, y + jitter_y, wl)
+                y -= apply_realism(line_spacing, 2, spacing_variation, rng)
+            y -= line_spacing * 0.3
+        elif line_type == 'heading':
+            hfs = font_size + 3
+            layout.setFont(font_name, hfs)
+            layout.setFillColor(HexColor('#000000'))
+            wrapped_heading = wrap_text_measured(content, font_name, hfs, usable_width)
+            for wh, tw in wrapped_heading:
+                jitter_y = apply_realism(0, 1, jitter, rng)
+                layout.drawString(x_base, y + jitter_y, wh)
+                if underline_headings:
+                    layout.setStrokeColor(HexColor('#000000'))
+                    layout.setLineWidth(0.5)
+                    layout.line(x_base, y - 2, x_base + tw, y - 2)
+                y -= line_spacing * 1.2
+            y -= line_spacing * 0.3
+        elif line_type == 'answer_label':
+            layout.setFillColor(ink.line_color(ink_variation, rng))
+            layout.setFont(font_name, font_size)
+            jitter_x = apply_realism(0, 1, jitter, rng)
+            jitter_y = apply_realism(0, 1, jitter, rng)
+            layout.drawString(x_base + jitter_x, y + jitter_y, content)
+            y -= apply_realism(line_spacing, 2, spacing_variation, rng)
+        else:
+            realistic_settings = {
+                'word_size_variation': word_size_variation,
+                'baseline_shift': baseline_shift,
+                'jitter_strength': jitter_strength,
+            }
+            wrapped = wrap_text(content, font_name, font_size, usable_width)
+            for wl in wrapped:
+                if y < margin_bottom:
+                    # A long paragraph can fill many pages; hand them over as they fill
+                    y = new_page()
+                    yield layout.pages.pop(0)
+                jitter_x = apply_realism(0, 1.5, jitter, rng)
+                jitter_y = apply_realism(0, 1, jitter, rng)
+                start_y = y
+                if (spacing_variation or jitter) and (word_size_variation or baseline_shift or ink_flow):
+                    end_y = draw_realistic_text(layout, wl, x_base + jitter_x, y + jitter_y, font_name, font_size, ink, realistic_settings, usable_width, rng)
+                    y = end_y - apply_realism(line_spacing, 1.5, spacing_variation, rng)
+                elif spacing_variation and jitter:
+                    end_y = draw_jittered_text(layout, wl, x_base + jitter_x, y + jitter_y, font_name, font_size, usable_width, rng)
+                    y = end_y - apply_realism(line_spacing, 1.5, spacing_variation, rng)
+                else:
+                    layout.setFillColor(ink.line_color(ink_variation or ink_flow, rng))
+                    layout.setFont(font_name, font_size)
+                    layout.drawString(x_base + jitter_x, y + jitter_y, wl)
+                    y -= apply_realism(line_spacing, 2, spacing_variation, rng)
+
+        if y < margin_bottom:
+            y = new_page()
+
+    if signature_data:
+        try:
+            import base64
+            from PIL import Image
+            from reportlab.lib.utils import ImageReader
+            raw = signature_data
+            if ',' in raw:
+                raw = raw.split(',', 1)[1]
+            img_data = base64.b64decode(raw)
+            img = Image.open(BytesIO(img_data)).convert('RGBA')
+            img.thumbnail((120, 50), Image.Resampling.LANCZOS)
+            buf = BytesIO()
+            img.save(buf, 'PNG')
+            buf.seek(0)
+            ir = ImageReader(buf)
+            layout.drawImage(ir, margin_left, margin_bottom, width=img.width, height=img.height)
+        except Exception:
+            pass
+
+    yield from layout.pages
+    layout.pages = [[]]
+
+def _begin_pdf(settings, output):
+    """Canvas, output filename, rng and page background form for one render."""
+    from reportlab.pdfgen import canvas as pdf_canvas
+    page_size = PAGE_SIZES.get(settings.get('page_size', 'A4'), A4)
+    width, height = page_size
+
+    # A seed (deterministic mode) makes the whole document reproducible; each
+    # render has its own Random, so concurrent renders share no random state
+    seed = settings.get('seed')
+    rng = random.Random(seed)
+
+    if output is None:
+        filename = f"{uuid.uuid4().hex}.pdf"
+        output = os.path.join(GENERATED_DIR, filename)
+        ensure_generated_dir()
+    else:
+        filename = output
+
+    c = pdf_canvas.Canvas(output, pagesize=page_size, invariant=int(seed is not None))
+    background = page_background_form(c, width, height, settings, rng)
+    return c, filename, rng, background
+
+def generate_pdf(text, settings, output=None):
+    """Render text to a PDF.
+
+    Lays the whole document out first, then draws it page by page, so the
+    footer can show an exact "Page X of Y".
+
+    Writes into output (a binary file-like object) when given and returns it;
+    otherwise writes a new file in GENERATED_DIR and returns its name.
+    """
+    c, filename, rng, background = _begin_pdf(settings, output)
+    with metrics.span('layout'):
+        layout = layout_document(text, settings, rng)
+
+    total_pages = len(layout.pages)
+    with metrics.span('draw'):
+        for index in range(total_pages):
+            if index:
+                c.showPage()
+            c.doForm(background)
+            draw_header_footer(c, layout, settings, index + 1, total_pages)
+            layout.replay(c, index)
+
+    with metrics.span('pdf_save'):
+        c.save()
+    if metrics.ENABLED:
+        _count_output(layout.pages, output, filename)
+    return filename
+
+def generate_pdf_from_lines(lines, settings, output=None):
+    """Render an iterable of lines to a PDF, drawing each page as soon as it is laid out.
+
+    For documents too long to hold as one string: memory stays flat apart
+    from the finished pages' compressed streams, which ReportLab keeps until
+    save, and the longest line (see MAX_LINE_CHARS in iter_text_lines). The total page count is unknown while drawing, so page numbers read
+    "Page X". Output is otherwise identical to generate_pdf on the joined text.
+    """
+    c, filename, rng, background = _begin_pdf(settings, output)
+    layout = DocumentLayout.from_settings(settings)
+    for page_num, ops in enumerate(iter_pages(layout, lines, settings, rng), 1):
+        if page_num > 1:
+            c.showPage()
+        c.doForm(background)
+        draw_header_footer(c, layout, settings, page_num)
+        replay_page(c, ops)
+        if metrics.ENABLED:
+            metrics.count('pages')
+            metrics.count('glyph_draws', _glyph_draws(ops))
+
+    with metrics.span('pdf_save'):
+        c.save()
+    if metrics.ENABLED:
+        _count_output((), output, filename)
+    return filename
+
+def _glyph_draws(ops):
+    """Strings and text-run glyphs among a page's recorded operations."""
+    return sum(len(args[1]) if op == 'drawTextRun' else 1
+               for op, *args in ops if op in ('drawString', 'drawTextRun'))
+
+def _count_output(pages, output, filename):
+    """Metrics counters for a finished render: pages, glyph draws and PDF bytes."""
+    if pages:
+        metrics.count('pages', len(pages))
+        metrics.count('glyph_draws', sum(map(_glyph_draws, pages)))
+    if output is None:
+        metrics.count('output_bytes', os.path.getsize(os.path.join(GENERATED_DIR, filename)))
+    else:
+        metrics.count('output_bytes', output.tell())
+
+@metrics.timed('draw_jittered_text')
+def draw_jittered_text(c, text, x, y, font_name, font_size, max_width=None, rng=None):
+    """Draw text with per-character jitter; wrap to next line if max_width exceeded."""
+    if rng is None:
+        rng = random.Random()
+    start_x = x
+    current_y = y
+    line_height = font_size * 1.35
+    effective_max = (max_width - 4) if max_width else None
+    glyphs = []
+    for char, cw in zip(text, glyph_widths(text, font_name, font_size)):
+        extra = rng.uniform(-0.2, 0.25)
+        if effective_max and (x - start_x) + cw + max(0, extra) > effective_max and (x > start_x):
+            x = start_x
+            current_y -= line_height
+            extra = 0
+        jx = rng.uniform(-0.4, 0.4)
+        jy = rng.uniform(-0.5, 0.5)
+        if char != ' ':
+            glyphs.append((x + jx, current_y, jy, char, None, None))
+        x += cw + extra
+    if glyphs:
+        c.drawTextRun(font_name, glyphs)
+    return current_y
+
+
+# Ink flow fades a line by up to 12% from its first word to its last, in this many steps
+INK_FADE_LEVELS = 4
+# Random ink shades pre-drawn per document; every line picks one
+INK_SHADES = 16
+
+
+class InkPalette:
+    """Every ink color one document is drawn with, built once per render.
+
+    Realistic text takes a shade per line, then steps through that shade's
+    ink flow levels (darker at the start of the line, slightly faded at the
+    end) by word position. Consecutive words therefore share one Color
+    object, and draw_text_run only emits a fill color when it changes. The
+    plain renderers pick a per-line color with line_color.
+    """
+
+    def __init__(self, base_hex, ink_flow=True, gel_pen=False, rng=random):
+        from reportlab.lib.colors import Color, HexColor
+        self.base = base = HexColor(base_hex)
+        levels = INK_FADE_LEVELS if ink_flow else 1
+        self.ramps = []
+        for _ in range(INK_SHADES):
+            shade = [rng.uniform(-0.02, 0.02) for _ in range(3)]
+            ramp = []
+            for level in range(levels):
+                fade = 1.0 - (level / INK_FADE_LEVELS * 0.12)
+                r, g, b = base.red * fade, base.green * fade, base.blue * fade
+                if gel_pen:
+                    # Gel pen: slightly richer/darker
+                    r, g, b = min(1, r * 1.08), min(1, g * 1.02), min(1, b * 0.95)
+                ramp.append(Color(*(min(1, max(0, v + d)) for v, d in zip((r, g, b), shade))))
+            self.ramps.append(ramp * (INK_FADE_LEVELS // levels))
+        self.line_colors = [Color(*(min(1, max(0, v + rng.uniform(-0.03, 0.03)))
+                                    for v in (base.red, base.green, base.blue)))
+                            for _ in range(INK_SHADES)]
+
+    def ramp(self, rng=random):
+        """Colors for one line of realistic text, indexed by word position * INK_FADE_LEVELS // words."""
+        return self.ramps[rng.randrange(INK_SHADES)]
+
+    def line_color(self, vary=True, rng=random):
+        """Fill color for one plain line: a pre-drawn variation of the ink, or the ink itself."""
+        return self.line_colors[rng.randrange(INK_SHADES)] if vary else self.base
+
+
+@metrics.timed('draw_realistic_text')
+def draw_realistic_text(c, text, x, y, font_name, font_size, ink, settings, max_width=None, rng=None):
+    """Per-letter variation: word size variation, baseline shift, horizontal jitter. Respects max_width for wrapping.
+
+    ink is the document's InkPalette.
+    """
+    word_size_var = settings.get('word_size_variation', True)
+    baseline_shift = settings.get('baseline_shift', True)
+    jitter_strength = settings.get('jitter_strength', 1.0)
+    words = text.split()
+    if not words:
+        return y
+    if rng is None:
+        rng = random.Random()
+    ramp = ink.ramp(rng)
+    current_x = x
+    current_y = y
+    line_height = font_size * 1.4
+    # Leave room for horizontal jitter so we never draw past margin
+    effective_max = (max_width - 5) if max_width else None
+    glyphs = []
+    for i, word in enumerate(words):
+        color = ramp[i * INK_FADE_LEVELS // len(words)]
+        size = font_size
+        if word_size_var:
+            size = font_size + rng.uniform(-1.2, 1.5)
+            size = max(font_size - 1, min(font_size + 2, size))
+        word_width = text_width(word, font_name, size)
+        space_width = text_width(' ', font_name, size) if current_x > x else 0
+        random_spacing = rng.uniform(-0.1, 0.2)
+        current_line_width = current_x - x
+        total_width_needed = current_line_width + space_width + word_width + max(0, random_spacing)
+        if effective_max and total_width_needed > effective_max:
+            if current_x > x:
+                current_x = x
+                current_y -= line_height
+                space_width = 0
+                random_spacing = 0
+            else:
+                # Word itself is too wide, truncate to fit
+                if word_width > effective_max:
+                    ratio = (effective_max - 2) / word_width
+                    word = word[:max(1, int(len(word) * ratio))]
+                    word_width = text_width(word, font_name, size)
+        by = current_y
+        if baseline_shift:
+            by = current_y + rng.uniform(-1.2, 1.2) * jitter_strength
+        jx = rng.uniform(-0.5, 0.5) * jitter_strength if jitter_strength else 0
+        jy = rng.uniform(-0.5, 0.5) * jitter_strength if jitter_strength else 0
+        if current_x > x and space_width > 0:
+            current_x += space_width
+        glyphs.append((current_x + jx, current_y, by + jy - current_y, word, size, color))
+        current_x += word_width + random_spacing
+        if effective_max and (current_x - x) > effective_max:
+            current_x = x + effective_max
+    c.drawTextRun(font_name, glyphs)
+    return current_y
+
+@metrics.timed('wrap_text')
+def wrap_text_measured(text, font_name, font_size, max_width):
+    """Wrap text like wrap_text, returning (line, width) pairs.
+
+    Keeps a running width per line so every word is measured once instead of
+    re-measuring the whole line for each word appended to it.
+    """
+    words = text.split()
+    if not words:
+        return [('', 0.0)]
+    scale = 0.001 * font_size
+    # Use 85% so variable font size (+2pt) and per-char/word jitter don't overflow
+    safe_width = max_width * 0.85
+    space_units = text_units(' ', font_name)
+    word_units = {}
+    lines = []
+    line_words = []
+    line_units = 0.0
+    for word in words:
+        units = word_units.get(word)
+        if units is None:
+            units = word_units[word] = text_units(word, font_name)
+        if line_words:
+            test_units = line_units + space_units + units
+            if scale * test_units <= safe_width:
+                line_words.append(word)
+                line_units = test_units
+                continue
+            lines.append((' '.join(line_words), scale * line_units))
+        line_words = [word]
+        line_units = units
+    lines.append((' '.join(line_words), scale * line_units))
+    return lines
+
+def wrap_text(text, font_name, font_size, max_width):
+    """Wrap text to fit within max_width, with safety margin for variable font sizes and jitter."""
+    return [line for line, _ in wrap_text_measured(text, font_name, font_size, max_width)]
+
+
+class DecodedStream:
+    """Text read(n) over a binary stream that may offer nothing but read(n).
+
+    WSGI servers hand over request bodies like that (gunicorn's Body has no
+    readable() or readinto(), so io.BufferedReader/TextIOWrapper cannot wrap
+    it). Bytes are decoded incrementally, so a character split across two
+    reads comes out whole; undecodable bytes become U+FFFD.
+    """
+
+    def __init__(self, raw, encoding='utf-8'):
+        self.raw = raw
+        self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self._pending = ''
+        self._eof = False
+
+    def read(self, size):
+        if self._pending:
+            text, self._pending = self._pending, ''
+            return text
+        while not self._eof:
+            data = self.raw.read(size)
+            self._eof = not data
+            text = self._decoder.decode(data, final=self._eof)
+            if text:
+                return text
+        return ''
+
+    def peek(self):
+        """Some text without consuming it; '' only when the stream is empty."""
+        if not self._pending:
+            self._pending = self.read(1)
+        return self._pending
+
+
+# Longest line iter_text_lines hands on; longer ones (pasted text without
+# newlines) are cut at a space so a single paragraph cannot grow unbounded.
+# Above MAX_TEXT_CHARS' default, so JSON-sized texts are never cut.
+MAX_LINE_CHARS = 64 * 1024
+
+
+def _cut_long_line(line):
+    """(head, rest): line cut at its last space within MAX_LINE_CHARS, or at MAX_LINE_CHARS."""
+    cut = line.rfind(' ', 0, MAX_LINE_CHARS + 1)
+    if cut <= 0:
+        cut = MAX_LINE_CHARS
+    return line[:cut], line[cut:].lstrip(' ')
+
+
+def iter_text_lines(stream, max_chars=None, chunk_size=64 * 1024):
+    """Sanitized lines of a text stream, read a chunk at a time.
+
+    Yields the same lines as sanitize_text(text[:max_chars]).split('\\n')
+    without ever holding the whole text, except that lines longer than
+    MAX_LINE_CHARS are split into several at word boundaries.
+    """
+    pending = ''
+    remaining = max_chars
+    while remaining is None or remaining > 0:
+        chunk = stream.read(chunk_size if remaining is None else min(chunk_size, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        *lines, pending = (pending + chunk).split('\n')
+        for line in lines:
+            while len(line) > MAX_LINE_CHARS:
+                head, line = _cut_long_line(line)
+                yield sanitize_text(head)
+            yield sanitize_text(line)
+        while len(pending) > MAX_LINE_CHARS:
+            head, pending = _cut_long_line(pending)
+            yield sanitize_text(head)
+    yield sanitize_text(pending)
+
+
+def normalize_text(text):
+    """Canonical form of submitted text: line endings unified, per-line whitespace trimmed."""
+    return '\n'.join(line.strip() for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'))
+
+
+def result_cache_key(text, settings):
+    """Content hash of the normalized text plus every setting that affects the output."""
+    relevant = {k: v for k, v in settings.items() if k not in ('deterministic', 'seed')}
+    payload = json.dumps({'text': normalize_text(text), 'settings': relevant}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def seeded_inputs(text, settings):
+    """Normalized text and settings seeded from result_cache_key, so identical requests render identical PDFs."""
+    return normalize_text(text), dict(settings, seed=int(result_cache_key(text, settings)[:16], 16))
+
+
+# Longest text a JSON request may carry; the rest is cut off. Longer documents
+# go through iter_text_lines/generate_pdf_from_lines, which never hold the whole text.
+MAX_TEXT_CHARS = max(1, int(os.environ.get('MAX_TEXT_CHARS', '50000')))
+
+
+def parse_int(val, default, lo, hi):
+    try:
+        return max(lo, min(hi, int(val)))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_float(val, default, lo, hi):
+    try:
+        return max(lo, min(hi, float(val)))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_bool(val, default=True):
+    if val is None:
+        return default
+    if isinstance(val, bool):
+        return val
+    return default
+
+
+def parse_str(val, default):
+    if isinstance(val, str) and val:
+        return val
+    return default
+
+
+def parse_choice(val, choices, default):
+    return val if val in choices else default
+
+
+def parse_generate_request(data):
+    """Turn a /api/generate JSON body into (text, settings) for generate_pdf."""
+    return sanitize_text(data['text'][:MAX_TEXT_CHARS]), parse_settings(data)
+
+
+def parse_settings(data):
+    """Validated render settings from a /api/generate body (everything but the text)."""
+    settings = {
+        'font': parse_str(data.get('font'), 'ComicNeue'),
+        'font_size': parse_int(data.get('font_size'), 18, 10, 36),
+        'line_spacing': parse_int(data.get('line_spacing'), 28, 16, 50),
+        'ink_color': parse_str(data.get('ink_color'), '#0A1F5C'),
+        'margin_left': parse_int(data.get('margin_left'), 60, 20, 120),
+        'page_style': parse_choice(data.get('page_style'), PAGE_STYLES, 'blank'),
+        'page_size': parse_str(data.get('page_size'), 'A4'),
+        'background_seed': parse_int(data.get('background_seed'), None, 0, 2**31 - 1),
+        'spacing_variation': parse_bool(data.get('spacing_variation'), True),
+        'jitter': parse_bool(data.get('jitter'), True),
+        'ink_variation': parse_bool(data.get('ink_variation'), True),
+        'word_size_variation': parse_bool(data.get('word_size_variation'), True),
+        'baseline_shift': parse_bool(data.get('baseline_shift'), True),
+        'jitter_strength': parse_float(data.get('jitter_strength'), 1.0, 0.2, 2.0),
+        'ink_flow': parse_bool(data.get('ink_flow'), True),
+        'gel_pen': parse_bool(data.get('gel_pen'), False),
+        'new_question_on_new_page': parse_bool(data.get('new_question_on_new_page'), False),
+        'margin_rule': parse_bool(data.get('margin_rule'), True),
+        'double_margin': parse_bool(data.get('double_margin'), False),
+        'bold_question': parse_bool(data.get('bold_question'), False),
+        'underline_headings': parse_bool(data.get('underline_headings'), False),
+        'signature_base64': parse_str(data.get('signature_base64'), None),
+        'page_numbers': parse_bool(data.get('page_numbers'), False),
+        'header_text': parse_str(data.get('header_text'), '').strip()[:200],
+        'footer_text': parse_str(data.get('footer_text'), '').strip()[:200],
+        'watermark_text': parse_str(data.get('watermark_text'), '').strip()[:100],
+        'deterministic': parse_bool(data.get('deterministic'), False),
+    }
+
+    ink = settings['ink_color']
+    if not re.match(r'^#[0-9a-fA-F]{6}$', ink):
+        settings['ink_color'] = '#0A1F5C'
+
+    fonts = available_fonts()
+    if settings['font'] not in fonts:
+        settings['font'] = list(fonts.keys())[0] if fonts else 'Helvetica'
+
+    return settings
@@ -241,6 +241,68 @@ function loadSettings() {
     } catch(e) {}
 }
 
+// Incremental preview: the server keeps a copy of the document's line layout,
+// so after the first request only the changed lines are sent and classified.
+const PREVIEW_MAX_CHARS = 50000;
+const previewDocId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+let previewRevision = 0;
+let previewSentLines = null;
+let previewLines = [];
+let previewQueue = Promise.resolve();
+
+function diffLines(oldLines, newLines) {
+    let start = 0;
+    const max = Math.min(oldLines.length, newLines.length);
+    while (start < max && oldLines[start] === newLines[start]) start++;
+    let oldEnd = oldLines.length;
+    let newEnd = newLines.length;
+    while (oldEnd > start && newEnd > start && oldLines[oldEnd - 1] === newLines[newEnd - 1]) {
+        oldEnd--;
+        newEnd--;
+    }
+    return { start: start, delete: oldEnd - start, lines: newLines.slice(start, newEnd) };
+}
+
+function postPreview(body) {
+    return fetch('/api/preview', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+}
+
+async function fetchPreviewLines(text) {
+    const lines = text.split('\n');
+    if (previewSentLines) {
+        const change = diffLines(previewSentLines, lines);
+        if (change.delete === 0 && change.lines.length === 0) return previewLines;
+        const revision = previewRevision + 1;
+        const response = await postPreview({
+            doc_id: previewDocId, base_revision: previewRevision, revision: revision, changes: [change]
+        });
+        if (response.ok) {
+            const data = await response.json();
+            data.changes.forEach(function(c) {
+                previewLines.splice(c.start, c.delete, ...c.lines);
+            });
+            previewRevision = revision;
+            previewSentLines = lines;
+            return previewLines;
+        }
+        previewSentLines = null;
+        if (response.status !== 409) throw new Error('Preview failed');
+    }
+    const revision = previewRevision + 1;
+    const response = await postPreview({ text: text, doc_id: previewDocId, revision: revision });
+    const data = await response.json();
+    if (!data.lines) throw new Error(data.error || 'Preview failed');
+    previewLines = data.lines;
+    previewRevision = revision;
+    // Longer text is truncated server-side, so diffs against it would not line up
+    previewSentLines = text.length <= PREVIEW_MAX_CHARS ? lines : null;
+    return previewLines;
+}
+
 function updatePreview() {
     const text = textInput.value.trim();
     if (!text) {
@@ -249,50 +311,50 @@ function updatePreview() {
         return;
     }
 
-    fetch('/api/preview', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text: textInput.value })
+    const fullText = textInput.value;
+    previewQueue = previewQueue
+    .then(() => fetchPreviewLines(fullText))
+    .then(lines => {
+        if (textInput.value !== fullText) return;
+        renderPreview(lines);
     })
-    .then(r => r.json())
-    .then(data => {
-        if (data.lines) {
-            const settings = getSettings();
-            const fontFamily = getFontFamily(settings.font);
-            const sizeScale = settings.font_size / 18;
-            const spacingScale = settings.line_spacing / 28;
-
-            previewPage.className = `preview-page ${settings.page_style}`;
-            const marginPx = settings.margin_left || 60;
-            previewPage.style.paddingLeft = marginPx + 'px';
-            if (settings.page_style === 'notebook' || settings.page_style === 'legal_yellow') {
-                previewPage.style.backgroundSize = `100% ${settings.line_spacing}px`;
-            } else {
-                previewPage.style.backgroundSize = '';
-            }
+    .catch(() => {});
+}
 
-            var underlineHeadings = !!settings.underline_headings;
-            var marginRule = !!settings.margin_rule;
-            var doubleMargin = !!settings.double_margin;
-            var boldQuestion = !!settings.bold_question;
-            previewPage.style.borderLeft = marginRule ? (doubleMargin ? '4px solid #ff9999' : '3px solid #ff9999') : 'none';
-            if (doubleMargin && marginRule) {
-                previewPage.style.paddingLeft = (marginPx + 14) + 'px';
-            }
+function renderPreview(lines) {
+    const settings = getSettings();
+    const fontFamily = getFontFamily(settings.font);
+    const sizeScale = settings.font_size / 18;
+    const spacingScale = settings.line_spacing / 28;
+
+    previewPage.className = `preview-page ${settings.page_style}`;
+    const marginPx = settings.margin_left || 60;
+    previewPage.style.paddingLeft = marginPx + 'px';
+    if (settings.page_style === 'notebook' || settings.page_style === 'legal_yellow') {
+        previewPage.style.backgroundSize = `100% ${settings.line_spacing}px`;
+    } else {
+        previewPage.style.backgroundSize = '';
+    }
 
-            var html = '';
-            data.lines.forEach(function(line) {
-                var color = (line.type === 'answer' || line.type === 'answer_label') ? settings.ink_color : '';
-                var style = 'font-family: ' + fontFamily + '; font-size: ' + sizeScale + 'em; line-height: ' + (spacingScale * 1.6) + '; ' + (color ? 'color:' + color + ';' : '');
-                var extraClass = '';
-                if (underlineHeadings && (line.type === 'title' || line.type === 'heading')) extraClass += ' preview-underline';
-                if (boldQuestion && line.type === 'question') extraClass += ' preview-bold';
-                html += '<div class="preview-line ' + line.type + extraClass + '" style="' + style + '">' + escapeHtml(line.content) + '</div>';
-            });
-            previewPage.innerHTML = html;
-        }
-    })
-    .catch(() => {});
+    var underlineHeadings = !!settings.underline_headings;
+    var marginRule = !!settings.margin_rule;
+    var doubleMargin = !!settings.double_margin;
+    var boldQuestion = !!settings.bold_question;
+    previewPage.style.borderLeft = marginRule ? (doubleMargin ? '4px solid #ff9999' : '3px solid #ff9999') : 'none';
+    if (doubleMargin && marginRule) {
+        previewPage.style.paddingLeft = (marginPx + 14) + 'px';
+    }
+
+    var html = '';
+    lines.forEach(function(line) {
+        var color = (line.type === 'answer' || line.type === 'answer_label') ? settings.ink_color : '';
+        var style = 'font-family: ' + fontFamily + '; font-size: ' + sizeScale + 'em; line-height: ' + (spacingScale * 1.6) + '; ' + (color ? 'color:' + color + ';' : '');
+        var extraClass = '';
+        if (underlineHeadings && (line.type === 'title' || line.type === 'heading')) extraClass += ' preview-underline';
+        if (boldQuestion && line.type === 'question') extraClass += ' preview-bold';
+        html += '<div class="preview-line ' + line.type + extraClass + '" style="' + style + '">' + escapeHtml(line.content) + '</div>';
+    });
+    previewPage.innerHTML = html;
 }
 
 function escapeHtml(text) {